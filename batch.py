@@ -0,0 +1,385 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import glob
+import json
+import time
+import shutil
+import tempfile
+import multiprocessing
+import logging
+
+from core import Data, PSFrag
+from cache import RenderCache
+from texformat import FormatCache
+from library import SubsLibrary
+from pipeline import Pipeline, PipelineError
+
+logging.getLogger('batch').addHandler(logging.NullHandler())
+_texformat = None
+
+""" Headless batch mode: converts many EPS files using a pool of worker processes.
+"""
+
+
+def expand_inputs(paths):
+    """ Expands a list of files, glob patterns and directories into a sorted list of .eps files.
+        Duplicated files are only returned once.
+    """
+    logger = logging.getLogger('batch.expand_inputs')
+    found = []
+    for path in paths:
+        path = os.path.expanduser(path)
+        if os.path.isdir(path):
+            candidates = glob.glob(os.path.join(path, '*.eps'))
+        elif glob.has_magic(path):
+            candidates = glob.glob(path)
+        else:
+            candidates = [path]
+        if not candidates:
+            logger.warning("No .eps files found in %s." % path)
+        for eps in sorted(candidates):
+            # Skip the outputs of previous runs
+            if eps.endswith('-latex.eps') or eps.endswith('-crop.eps'):
+                continue
+            if eps not in found:
+                found.append(eps)
+    return found
+
+
+def format_cache():
+    """ FormatCache shared by the jobs of a worker process, so the TeX installation is identified once."""
+    global _texformat
+    if _texformat is None:
+        _texformat = FormatCache()
+    return _texformat
+
+
+def load_job(epspath, subspath, cwd, options):
+    """ Loads the eps file and the substitutions.
+        :return: tuple (data, psfrag).
+    """
+    data = Data(epspath, subspath, cwd, options['pdf'], options['svg'], options['png'], options['dsty'])
+    data.eps = options.get('eps', True)
+    if data.ferror:
+        raise ValueError("not an .eps file")
+    found = data.load_subs_labels()
+    if options.get('suggest'):
+        library = SubsLibrary(options.get('library'))
+        found = len(data.suggest_labels(library, options.get('project'))) > 0 or found
+        library.close()
+    if not found:
+        raise ValueError("no substitutions to be made")
+    cache = None
+    if not options.get('nocache', True):
+        cache = RenderCache(maxsize=options['cachesize'])
+    texformat = None
+    if not options.get('noformat', True):
+        texformat = format_cache()
+    psfrag = PSFrag(data, cache, texformat)
+    psfrag.set_packages(options.get('packages'))
+    psfrag.engine = options.get('engine', 'classic')
+    psfrag.profile = bool(options.get('profile'))
+    psfrag.scratch = bool(options.get('scratch') or options.get('outdir'))
+    # The combined document is built in a temporary directory, not incrementally
+    if not options.get('combine'):
+        psfrag.buildroot = options.get('builddir')
+    psfrag.require = options.get('require')
+    psfrag.optimize = options.get('optimize')
+    return data, psfrag
+
+
+def prepare_job(epspath, subspath, cwd, options):
+    """ Loads the eps file and the substitutions, checks the tags and writes the subs-<name>.tex file.
+        :return: tuple (data, psfrag).
+    """
+    data, psfrag = load_job(epspath, subspath, cwd, options)
+    psfrag.validate()
+    psfrag.create_subs()
+    return data, psfrag
+
+
+def check_files(epsfiles, subspath, cwd, options):
+    """ Checks the tags of every file against its eps labels, without compiling anything.
+        :return: list of tuples (epspath, missing tags, unused texts), or (epspath, None, error).
+    """
+    results = []
+    for epspath in epsfiles:
+        try:
+            data, psfrag = load_job(epspath, subspath, cwd, options)
+        except (IOError, ValueError) as e:
+            results.append((epspath, None, str(e)))
+            continue
+        missing, unused = psfrag.check_labels()
+        results.append((epspath, missing, unused))
+    return results
+
+
+def print_check(results):
+    """ Prints the missing tags and the texts without replacement of every checked file and returns
+        the number of files with missing tags (or that could not be checked).
+    """
+    bad = 0
+    print "\n\tTag check:"
+    for epspath, missing, unused in results:
+        if missing is None:
+            bad += 1
+            print "\t  [FAILED] %s: %s" % (epspath, unused)
+            continue
+        if missing:
+            bad += 1
+            print "\t  [MISSING] %s: %s" % (epspath, ", ".join(missing))
+        else:
+            print "\t  [  OK  ] %s" % epspath
+        if unused:
+            print "\t            without replacement: %s" % ", ".join(unused)
+    print "\n\t%d files, %d with all their tags, %d with missing tags.\n" % (len(results), len(results) - bad,
+                                                                               bad)
+    return bad
+
+
+def job_result(data, psfrag, t0, outputs):
+    """ :param outputs: output files of the job, as returned by PSFrag.collect."""
+    if not data.eps and outputs:
+        return data.epspath, True, ", ".join(sorted(outputs.values())), time.time() - t0, psfrag.report
+    output = outputs.get('-latex.eps', "%s/%s-latex.eps" % (data.epsdir, data.epsname))
+    if data.eps and not os.path.exists(output):
+        return data.epspath, False, "%s was not created" % output, time.time() - t0, psfrag.report
+    return data.epspath, True, output, time.time() - t0, psfrag.report
+
+
+def render_job(job):
+    """ Runs the whole replacement for a single file. It is executed in a worker process.
+        :param job: tuple (epspath, subspath, cwd, options), options being a dictionary with
+                    the output formats ('pdf', 'svg', 'png'), the png density ('dsty'), the
+                    render cache options ('nocache', 'cachesize'), the extra LaTeX packages
+                    ('packages'), whether to use a precompiled format ('noformat') and the
+                    conversion engine ('engine'). With options['profile'], every job writes
+                    its measures in <name>-report.json. With options['suggest'], the replacements
+                    missing in the substitution file are taken from the library ('library', 'project').
+                    With options['scratch'], the job works in a private scratch directory and only
+                    the outputs are moved out of it, to options['outdir'] or next to the eps file.
+                    With options['builddir'], it works in a build directory of the figure under it,
+                    and only the stages whose inputs changed since the last build run.
+                    options['require'] ('all' or 'any') skips files whose tags are not found.
+        :return: tuple (epspath, success, message, elapsed time, report of the job or None).
+    """
+    epspath, subspath, cwd, options = job
+    logger = logging.getLogger('batch.render_job')
+    t0 = time.time()
+    psfrag = None
+    try:
+        data, psfrag = prepare_job(epspath, subspath, cwd, options)
+        psfrag.do_replace()
+        outputs = psfrag.collect(options.get('outdir'))
+    except Exception as e:
+        logger.debug("Job %s failed: %s" % (epspath, e))
+        if psfrag is not None:
+            psfrag.cleanup()
+        return epspath, False, str(e), time.time() - t0, psfrag.report if psfrag else None
+    return job_result(data, psfrag, t0, outputs)
+
+
+def render_combined(job):
+    """ Converts several files with a single LaTeX run: every figure goes to a page of the same
+        document, which is compiled and cropped once, and then split into the outputs of each figure.
+        If the combined document fails, the figures are converted one by one to find the broken ones.
+        :param job: tuple (epsfiles, subspath, cwd, options), as in render_job.
+        :return: list of results as returned by render_job.
+    """
+    epsfiles, subspath, cwd, options = job
+    logger = logging.getLogger('batch.render_combined')
+    t0 = time.time()
+    results = []
+    figures = []
+    for epspath in epsfiles:
+        psfrag = None
+        try:
+            data, psfrag = prepare_job(epspath, subspath, cwd, options)
+            filename = "%s/%s" % (psfrag.jobdir(), data.epsname)
+            key = None
+            if psfrag.cache is not None:
+                key = psfrag.cache_key()
+                if psfrag.cache.fetch(key, filename, psfrag.output_suffixes()):
+                    psfrag.make_report(time.time(), cached=True)
+                    results.append(job_result(data, psfrag, t0, psfrag.collect(options.get('outdir'))))
+                    continue
+            figures.append((data, psfrag, filename, key))
+        except Exception as e:
+            logger.debug("Job %s failed: %s" % (epspath, e))
+            if psfrag is not None:
+                psfrag.cleanup()
+            results.append((epspath, False, str(e), time.time() - t0, None))
+    if not figures:
+        return results
+
+    tmpdir = tempfile.mkdtemp(prefix='pypsfrag-')
+    combined = os.path.join(tmpdir, 'combined')
+    main = figures[0][1]
+    try:
+        main.write_latex(combined + '.tex', [(psfrag.subsname, psfrag.eps_reference(filename))
+                                             for _, psfrag, filename, _ in figures])
+        pipeline = Pipeline('combined')
+        main.add_document_stages(pipeline, tmpdir, combined, combined + '.tex',
+                                 [filename for _, _, filename, _ in figures],
+                                 dict((psfrag.subsname, psfrag.subslines) for _, psfrag, _, _ in figures))
+        logger.info("Compiling %d figures in a single LaTeX run ..." % len(figures))
+        t1 = time.time()
+        pipeline.run()
+    except (PipelineError, IOError, OSError, ValueError) as e:
+        logger.warning("%s" % e)
+        logger.warning("Combined compilation failed, converting the files one by one ...")
+        for data, psfrag, filename, key in figures:
+            psfrag.remove_files(filename, psfrag.intermediates)
+            psfrag.cleanup()
+            results.append(render_job((data.epspath, subspath, cwd, options)))
+        return results
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    # Every figure is charged with its share of the combined run. The report of every figure gets the
+    # stages of its own page, and the first one also gets the stages of the whole document.
+    elapsed = (time.time() - t0) / len(figures)
+    shared = [stage.name for stage in pipeline.stages if ':' not in stage.name]
+    for page, (data, psfrag, filename, key) in enumerate(figures, 1):
+        psfrag.remove_files(filename, psfrag.intermediates)
+        if key is not None:
+            psfrag.cache.store(key, filename, psfrag.output_suffixes())
+        stages = [stage.name for stage in pipeline.stages if stage.name.endswith(':%d' % page)]
+        if page == 1:
+            stages += shared
+        # The optimize stages of every page ran in the main job
+        psfrag.optimization = main.optimizations.get(filename)
+        psfrag.make_report(t1, pipeline, stages)
+        result = job_result(data, psfrag, t0, psfrag.collect(options.get('outdir')))
+        results.append(result[:3] + (elapsed,) + result[4:])
+    return results
+
+
+def run_batch(epsfiles, subspath, cwd, options, jobs=None):
+    """ Converts every file in epsfiles on a pool of jobs worker processes (all the cores by default).
+        With options['combine'], the files are split in one group per worker and every group is
+        compiled in a single LaTeX run (see render_combined).
+        :return: list of results as returned by render_job, in the same order as epsfiles.
+    """
+    logger = logging.getLogger('batch.run_batch')
+    if jobs is None or jobs < 1:
+        jobs = multiprocessing.cpu_count()
+    jobs = min(jobs, len(epsfiles)) or 1
+    logger.info("Converting %d files using %d worker processes ..." % (len(epsfiles), jobs))
+    if not options.get('noformat', True):
+        prepare_format(options.get('packages'), cwd)
+
+    if options.get('combine', False):
+        worker = render_combined
+        tasks = [(epsfiles[k::jobs], subspath, cwd, options) for k in range(jobs)]
+    else:
+        worker = render_job
+        tasks = [(eps, subspath, cwd, options) for eps in epsfiles]
+    results = {}
+
+    def collect(result):
+        if worker is render_combined:
+            for r in result:
+                results[r[0]] = r
+        else:
+            results[result[0]] = result
+            logger.debug("%s finished (%s)." % (result[0], 'ok' if result[1] else 'failed'))
+
+    run_pool(worker, tasks, jobs, collect)
+    return [results[eps] for eps in epsfiles]
+
+
+def prepare_format(packages, cwd):
+    """ Dumps the format of the preamble before the workers start, instead of every worker dumping its own copy."""
+    psfrag = PSFrag(Data(None, None, cwd), None, format_cache())
+    psfrag.set_packages(packages)
+    psfrag.latex_format()
+
+
+def run_pool(worker, tasks, jobs, callback):
+    """ Runs worker(task) for every task on a pool of jobs worker processes (in this process with a
+        single job) and calls callback(result) as they finish. The tasks are started in their order.
+    """
+    if jobs == 1:
+        for task in tasks:
+            callback(worker(task))
+        return
+    pool = multiprocessing.Pool(jobs)
+    try:
+        for result in pool.imap_unordered(worker, tasks):
+            callback(result)
+        pool.close()
+    except KeyboardInterrupt:
+        logging.getLogger('batch.run_pool').warning("Interrupted, terminating workers ...")
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def print_summary(results):
+    """ Prints a per-file summary of a batch run and returns the number of failed jobs."""
+    failed = 0
+    total = 0.0
+    print "\n\tBatch summary:"
+    for epspath, ok, message, elapsed, report in results:
+        total += elapsed
+        if ok:
+            print "\t  [  OK  ] %s (%.2f s) -> %s" % (epspath, elapsed, message)
+        else:
+            failed += 1
+            print "\t  [FAILED] %s (%.2f s): %s" % (epspath, elapsed, message)
+    print "\n\t%d files, %d succeeded, %d failed (%.2f s of work).\n" % (len(results), len(results) - failed,
+                                                                       failed, total)
+    return failed
+
+
+def job_status(result):
+    """ Report of a job that has none: it failed before the pipeline started, or it was skipped by a build
+        because its outputs were up to date.
+    """
+    epspath, ok, message, elapsed, report = result
+    if ok:
+        return {'file': epspath, 'status': 'up-to-date', 'error': None}
+    return {'file': epspath, 'status': 'failed', 'error': message}
+
+
+def write_report(results, reportname, wall):
+    """ Writes the aggregated measures of a batch run: totals per stage and the report of every job."""
+    stages = {}
+    for epspath, ok, message, elapsed, report in results:
+        for measure in (report or {}).get('stages', []):
+            # Stages of combined runs have the page as suffix
+            name = measure['stage'].split(':')[0]
+            total = stages.setdefault(name, {'count': 0, 'wall_time': 0.0, 'cpu_time': 0.0, 'output_size': 0})
+            total['count'] += 1
+            total['wall_time'] += measure['wall_time'] or 0.0
+            total['cpu_time'] += measure['cpu_time'] or 0.0
+            total['output_size'] += measure['output_size'] or 0
+    aggregate = {'files': len(results),
+                 'failed': len([r for r in results if not r[1]]),
+                 'cached': len([r for r in results if r[4] and r[4]['cached']]),
+                 'wall_time': wall,
+                 'stages': stages,
+                 'jobs': [r[4] or job_status(r) for r in results]}
+    f = open(reportname, 'w')
+    json.dump(aggregate, f, indent=2)
+    f.close()
+    logging.getLogger('batch.write_report').info("Report written in %s." % reportname)
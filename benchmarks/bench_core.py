@@ -0,0 +1,123 @@
+#!/usr/bin/python
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import shutil
+import tempfile
+import subprocess
+import logging
+from distutils.spawn import find_executable
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(scriptdir))
+sys.path.insert(0, scriptdir)
+
+from core import Data, PSFrag
+import synth
+import stubtools
+
+""" Benchmark of the core operations on synthetic figures of increasing size: loading the eps file,
+    parsing the substitutions, checking every label and the whole replacement. The LaTeX toolchain is
+    replaced by stubs when latex is not installed (or with --stub). Results can be saved as JSON, with
+    the current commit, to compare them across commits.
+"""
+
+# (paths, points per path, labels)
+SIZES = [(10, 100, 10), (100, 100, 50), (1000, 100, 200), (1000, 1000, 500)]
+
+parser = argparse.ArgumentParser(description='Benchmark of the core operations of PyPSfrag.')
+parser.add_argument('-n', '--repeat', default=3, dest='repeat', type=int, help='Runs of every measure (best is kept).')
+parser.add_argument('--stub', default=False, dest='stub', action='store_true',
+                    help='Use the stub toolchain even if latex is installed.')
+parser.add_argument('--no-replace', default=False, dest='noreplace', action='store_true',
+                    help='Do not measure the whole replacement.')
+parser.add_argument('--quick', default=False, dest='quick', action='store_true', help='Only the two smallest sizes.')
+parser.add_argument('-o', '--output', default=None, dest='output', type=str, metavar='<results.json>',
+                    help='Save the results as JSON.')
+args = parser.parse_args()
+logging.basicConfig(level=logging.ERROR)
+
+
+def best_of(func, repeat):
+    times = []
+    for k in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def commit():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=scriptdir, stdout=subprocess.PIPE,
+                                universal_newlines=True).communicate()[0].strip()
+    except OSError:
+        return None
+
+
+stub = args.stub or find_executable('latex') is None
+workdir = tempfile.mkdtemp(prefix='pypsfrag-bench-')
+if stub:
+    os.mkdir(os.path.join(workdir, 'bin'))
+    stubtools.activate(os.path.join(workdir, 'bin'))
+
+results = {'commit': commit(), 'toolchain': 'stub' if stub else 'latex', 'sizes': []}
+try:
+    print "\nToolchain: %s\n" % results['toolchain']
+    print "%6s %6s %6s %10s | %10s %10s %10s %10s" % ('paths', 'points', 'labels', 'eps (KB)', 'open (s)',
+                                                    'subs (s)', 'check (s)', 'replace (s)')
+    for npaths, npoints, nlabels in (SIZES[:2] if args.quick else SIZES):
+        epspath = os.path.join(workdir, 'synth-%d-%d-%d.eps' % (npaths, npoints, nlabels))
+        subspath = os.path.join(workdir, 'subs-%d.tex' % nlabels)
+        labels = synth.make_eps(epspath, npaths, npoints, nlabels)
+        synth.make_subs(subspath, labels)
+
+        data = Data(epspath, subspath, workdir)
+        data.load_subs_labels()
+        psfrag = PSFrag(data)
+
+        t_open = best_of(lambda: data.open_epsfile(epspath), args.repeat)
+        t_subs = best_of(data.read_subs, args.repeat)
+        t_check = best_of(lambda: [psfrag.check_tag(k) for k in range(len(data.labels))], args.repeat)
+        t_replace = None
+        if not args.noreplace:
+            def replace():
+                psfrag.create_subs()
+                psfrag.do_replace()
+            t_replace = best_of(replace, args.repeat)
+
+        size = os.path.getsize(epspath)
+        results['sizes'].append({'paths': npaths, 'points': npoints, 'labels': nlabels, 'eps_size': size,
+                                 'open_epsfile': t_open, 'read_subs': t_subs, 'check_tag': t_check,
+                                 'do_replace': t_replace})
+        print "%6d %6d %6d %10d | %10.4f %10.4f %10.4f %10s" % (npaths, npoints, nlabels, size / 1024, t_open,
+                                                            t_subs, t_check,
+                                                            '-' if t_replace is None else '%.4f' % t_replace)
+    print
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(results, f, indent=2)
+        f.close()
+        print "Results saved in %s.\n" % args.output
+finally:
+    shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,71 @@
+#!/usr/bin/python
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(scriptdir))
+
+from core import Data, PSFrag, ENGINES
+
+""" Compares the conversion engines: wall time of do_replace() and bounding box of the resulting eps,
+    on example/example.eps with the default substitution file.
+"""
+
+parser = argparse.ArgumentParser(description='Benchmark of the conversion engines.')
+parser.add_argument('-f', '--epsfile', default='%s/../example/example.eps' % scriptdir, dest='epsfile', type=str,
+                    help='.eps file to convert.')
+parser.add_argument('-s', '--subs', default='%s/../subs.tex' % scriptdir, dest='subs', type=str,
+                    help='.tex file where the substitutions are located.')
+parser.add_argument('-n', '--repeat', default=3, dest='repeat', type=int, help='Runs of every engine.')
+parser.add_argument('--pdf', default=False, dest='pdf', action='store_true', help='Also create the pdf output.')
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp(prefix='pypsfrag-bench-')
+try:
+    rows = []
+    for engine in ENGINES:
+        epspath = os.path.join(workdir, '%s.eps' % engine)
+        shutil.copyfile(args.epsfile, epspath)
+        times = []
+        for k in range(args.repeat):
+            data = Data(epspath, args.subs, workdir, args.pdf)
+            data.load_subs_labels()
+            psfrag = PSFrag(data)
+            psfrag.engine = engine
+            psfrag.create_subs()
+            t0 = time.time()
+            psfrag.do_replace()
+            times.append(time.time() - t0)
+        output = os.path.join(workdir, '%s-latex.eps' % engine)
+        bbox = Data.scan_epsfile(output)[1] if os.path.exists(output) else None
+        size = os.path.getsize(output) if os.path.exists(output) else 0
+        rows.append((engine, min(times), sum(times) / len(times), bbox, size))
+
+    print "\n%-8s %10s %10s %12s  %s" % ('engine', 'best (s)', 'mean (s)', 'eps (bytes)', 'bounding box')
+    for engine, best, mean, bbox, size in rows:
+        print "%-8s %10.3f %10.3f %12d  %s" % (engine, best, mean, size, bbox)
+    print
+finally:
+    shutil.rmtree(workdir, ignore_errors=True)
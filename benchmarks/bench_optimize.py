@@ -0,0 +1,128 @@
+#!/usr/bin/python
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import shutil
+import tempfile
+import logging
+from distutils.spawn import find_executable
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(scriptdir))
+sys.path.insert(0, scriptdir)
+
+from core import Data, PSFrag
+from epsopt import optimize_eps, TOLERANCE
+import synth
+import stubtools
+
+""" Benchmark of the pre-optimization of the eps files (--optimize): size reduction and time of the
+    optimization, and wall time of the whole replacement with and without it, on example/example.eps
+    and on synthetic plots of dense data. The LaTeX toolchain is replaced by stubs when latex is not
+    installed (or with --stub): the time saved downstream is then meaningless, only the optimization
+    itself is measured.
+"""
+
+# (curves, points per curve, labels)
+SIZES = [(10, 10000, 10), (20, 50000, 20), (50, 100000, 50)]
+
+parser = argparse.ArgumentParser(description='Benchmark of the pre-optimization of the eps files.')
+parser.add_argument('-t', '--tolerance', default=TOLERANCE, dest='tolerance', type=float,
+                    help='Tolerance of the path simplification, in points (default %.2f).' % TOLERANCE)
+parser.add_argument('-n', '--repeat', default=3, dest='repeat', type=int, help='Runs of every measure (best is kept).')
+parser.add_argument('--stub', default=False, dest='stub', action='store_true',
+                    help='Use the stub toolchain even if latex is installed.')
+parser.add_argument('--pdf', default=False, dest='pdf', action='store_true', help='Also create the pdf output.')
+parser.add_argument('--quick', default=False, dest='quick', action='store_true',
+                    help='Only the smallest synthetic size.')
+parser.add_argument('-o', '--output', default=None, dest='output', type=str, metavar='<results.json>',
+                    help='Save the results as JSON.')
+args = parser.parse_args()
+logging.basicConfig(level=logging.ERROR)
+
+
+def best_of(func, repeat):
+    times = []
+    for k in range(repeat):
+        t0 = time.time()
+        func()
+        times.append(time.time() - t0)
+    return min(times)
+
+
+def replace_time(epspath, subspath, tolerance):
+    data = Data(epspath, subspath, os.path.dirname(epspath), args.pdf)
+    data.load_subs_labels()
+    psfrag = PSFrag(data)
+    psfrag.optimize = tolerance
+
+    def replace():
+        psfrag.create_subs()
+        psfrag.do_replace()
+    return best_of(replace, args.repeat)
+
+
+stub = args.stub or find_executable('latex') is None
+workdir = tempfile.mkdtemp(prefix='pypsfrag-bench-')
+if stub:
+    os.mkdir(os.path.join(workdir, 'bin'))
+    stubtools.activate(os.path.join(workdir, 'bin'))
+
+results = {'toolchain': 'stub' if stub else 'latex', 'tolerance': args.tolerance, 'figures': []}
+try:
+    figures = [('example', os.path.join(scriptdir, '..', 'example', 'example.eps'),
+                os.path.join(scriptdir, '..', 'subs.tex'))]
+    for ncurves, npoints, nlabels in (SIZES[:1] if args.quick else SIZES):
+        name = 'plot-%d-%d' % (ncurves, npoints)
+        epspath = os.path.join(workdir, name + '.eps')
+        subspath = os.path.join(workdir, 'subs-%s.tex' % name)
+        synth.make_subs(subspath, synth.make_plot_eps(epspath, ncurves, npoints, nlabels))
+        figures.append((name, epspath, subspath))
+
+    print "\nToolchain: %s, tolerance: %.3f pt\n" % (results['toolchain'], args.tolerance)
+    print "%-18s %10s %10s %7s %9s | %11s %11s %9s" % ('figure', 'eps (KB)', 'opt (KB)', 'saved', 'opt (s)',
+                                                     'replace (s)', '+opt (s)', 'gain (s)')
+    for name, source, subspath in figures:
+        epspath = os.path.join(workdir, name + '.eps')
+        if source != epspath:
+            shutil.copyfile(source, epspath)
+        stats = optimize_eps(epspath, os.path.join(workdir, name + '-opt.eps'), args.tolerance)
+        t_plain = replace_time(epspath, subspath, None)
+        t_opt = replace_time(epspath, subspath, args.tolerance)
+        saved = 1.0 - float(stats['output_size']) / stats['input_size']
+        results['figures'].append({'figure': name, 'eps_size': stats['input_size'],
+                                   'optimized_size': stats['output_size'],
+                                   'segments': stats['segments'], 'segments_removed': stats['segments_removed'],
+                                   'settings_removed': stats['settings_removed'] + stats['newpaths_removed'],
+                                   'optimize': stats['time'], 'do_replace': t_plain, 'do_replace_optimized': t_opt})
+        print "%-18s %10d %10d %6.1f%% %9.3f | %11.3f %11.3f %9.3f" % (name, stats['input_size'] / 1024,
+                                                                     stats['output_size'] / 1024, 100 * saved,
+                                                                     stats['time'], t_plain, t_opt, t_plain - t_opt)
+    print
+    if args.output:
+        f = open(args.output, 'w')
+        json.dump(results, f, indent=2)
+        f.close()
+        print "Results saved in %s.\n" % args.output
+finally:
+    shutil.rmtree(workdir, ignore_errors=True)
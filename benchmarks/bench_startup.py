@@ -0,0 +1,88 @@
+#!/usr/bin/python
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+import subprocess
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+rootdir = os.path.dirname(scriptdir)
+
+""" Benchmark of the cold start of the command line: every command runs in a new interpreter, so what
+    is measured is the import time of the modules it needs plus the parsing of the arguments. The GUI
+    modules are only measured when GTK is installed. Results can be saved as JSON, with the current
+    commit, to compare them across commits.
+"""
+
+# (name, arguments of the interpreter)
+COMMANDS = [('python', ['-c', 'pass']),
+            ('import core', ['-c', 'import core']),
+            ('import gui', ['-c', 'import gui']),
+            ('pypsfrag --help', [os.path.join(rootdir, 'pypsfrag.py'), '--help']),
+            ('pypsfrag --nogui', [os.path.join(rootdir, 'pypsfrag.py'), '--nogui', '-db', 'ERROR'])]
+
+parser = argparse.ArgumentParser(description='Benchmark of the cold start of PyPSfrag.')
+parser.add_argument('-n', '--repeat', default=10, dest='repeat', type=int, help='Runs of every command.')
+parser.add_argument('-o', '--output', default=None, dest='output', type=str, metavar='<results.json>',
+                    help='Save the results as JSON.')
+args = parser.parse_args()
+
+
+def run(argv):
+    devnull = open(os.devnull, 'w')
+    t0 = time.time()
+    code = subprocess.call([sys.executable] + argv, cwd=rootdir, stdout=devnull, stderr=devnull)
+    elapsed = time.time() - t0
+    devnull.close()
+    return code, elapsed
+
+
+def commit():
+    try:
+        return subprocess.Popen(['git', 'rev-parse', '--short', 'HEAD'], cwd=scriptdir, stdout=subprocess.PIPE,
+                                universal_newlines=True).communicate()[0].strip()
+    except OSError:
+        return None
+
+
+def gtk_available():
+    return run(['-c', 'from gi.repository import Gtk'])[0] == 0
+
+
+results = {'commit': commit(), 'python': sys.version.split()[0], 'commands': []}
+gtk = gtk_available()
+print "\n%-20s %10s %10s %10s" % ('command', 'min (s)', 'median (s)', 'max (s)')
+for name, argv in COMMANDS:
+    if name == 'import gui' and not gtk:
+        print "%-20s %10s" % (name, 'no GTK')
+        continue
+    times = sorted(run(argv)[1] for k in range(args.repeat))
+    median = times[len(times) // 2]
+    print "%-20s %10.3f %10.3f %10.3f" % (name, times[0], median, times[-1])
+    results['commands'].append({'command': name, 'min': times[0], 'median': median, 'max': times[-1]})
+print
+
+if args.output:
+    f = open(args.output, 'w')
+    json.dump(results, f, indent=2)
+    f.close()
+    print "Results saved in %s.\n" % args.output
@@ -0,0 +1,61 @@
+#!/usr/bin/python
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os
+import sys
+import time
+import shutil
+import tempfile
+
+scriptdir = os.path.dirname(os.path.realpath(__file__))
+sys.path.insert(0, os.path.dirname(scriptdir))
+sys.path.insert(0, scriptdir)
+
+from subsparser import parse_subs
+import synth
+
+""" Benchmark of the substitution file parser on files with thousands of entries. The time per entry
+    should stay constant as the file grows (linear parse cost).
+"""
+
+parser = argparse.ArgumentParser(description='Benchmark of the substitution file parser.')
+parser.add_argument('-n', '--repeat', default=3, dest='repeat', type=int, help='Runs of every size (best is kept).')
+parser.add_argument('--sizes', default='1000,10000,50000,100000', dest='sizes', type=str,
+                    help='Comma separated numbers of entries.')
+args = parser.parse_args()
+
+workdir = tempfile.mkdtemp(prefix='pypsfrag-bench-')
+try:
+    print "\n%10s %12s %10s %14s" % ('entries', 'file (KB)', 'parse (s)', 'per entry (us)')
+    for size in [int(n) for n in args.sizes.split(',')]:
+        subspath = os.path.join(workdir, 'subs-%d.tex' % size)
+        synth.make_subs(subspath, [synth.label_name(k) for k in range(size)])
+        text = open(subspath).read()
+        best = None
+        for k in range(args.repeat):
+            t0 = time.time()
+            info, entries, errors = parse_subs(text)
+            elapsed = time.time() - t0
+            best = elapsed if best is None else min(best, elapsed)
+        assert len(entries) == size and not errors
+        print "%10d %12d %10.4f %14.2f" % (size, len(text) / 1024, best, 1e6 * best / size)
+    print
+finally:
+    shutil.rmtree(workdir, ignore_errors=True)
@@ -0,0 +1,117 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import random
+
+""" Synthetic EPS files and substitution files for the benchmarks. The figures look like the output of
+    plotting programs: a prolog, many paths made of lineto operations and text labels painted with show.
+"""
+
+PROLOG = """%%!PS-Adobe-3.0 EPSF-3.0
+%%%%BoundingBox: 0 0 %d %d
+%%%%Creator: pypsfrag benchmarks
+%%%%EndComments
+%%%%BeginProlog
+/m {moveto} def
+/l {lineto} def
+/s {stroke} def
+/n {newpath} def
+/SLW {setlinewidth} def
+/SRGB {setrgbcolor} def
+%%%%EndProlog
+/Helvetica findfont 12 scalefont setfont
+"""
+
+
+def label_name(k):
+    return "lbl%d" % k
+
+
+def make_eps(path, npaths=100, npoints=100, nlabels=10, width=600, height=400, seed=0):
+    """ Writes a synthetic eps file with npaths random paths of npoints points and nlabels text labels.
+        :return: list of the labels painted in the figure.
+    """
+    rnd = random.Random(seed)
+    labels = [label_name(k) for k in range(nlabels)]
+    # Labels are spread over the file, after the paths
+    after = {}
+    for k, label in enumerate(labels):
+        after.setdefault(k * npaths // max(1, nlabels), []).append(label)
+    f = open(path, 'w')
+    f.write(PROLOG % (width, height))
+    for p in range(npaths):
+        f.write("n\n%.3f %.3f %.3f SRGB\n0.5 SLW\n" % (rnd.random(), rnd.random(), rnd.random()))
+        f.write("%.2f %.2f m\n" % (rnd.uniform(0, width), rnd.uniform(0, height)))
+        for k in range(npoints):
+            f.write("%.2f %.2f l\n" % (rnd.uniform(0, width), rnd.uniform(0, height)))
+        f.write("s\n")
+        for label in after.get(p, []):
+            f.write("%.2f %.2f m\n(%s) show\n" % (rnd.uniform(0, width), rnd.uniform(0, height), label))
+    if not npaths:
+        for label in labels:
+            f.write("%.2f %.2f m\n(%s) show\n" % (rnd.uniform(0, width), rnd.uniform(0, height), label))
+    f.write("showpage\n%%EOF\n")
+    f.close()
+    return labels
+
+
+def make_plot_eps(path, ncurves=10, npoints=10000, nlabels=10, width=600, height=400, seed=0):
+    """ Writes a synthetic eps file like those of plotting programs for dense data: ncurves smooth curves
+        sampled at npoints points each (far more than the resolution needs), drawn in a unit square
+        scaled to the figure, with the line settings written again before every curve, and nlabels
+        text labels.
+        :return: list of the labels painted in the figure.
+    """
+    rnd = random.Random(seed)
+    labels = [label_name(k) for k in range(nlabels)]
+    f = open(path, 'w')
+    f.write(PROLOG % (width, height))
+    f.write("/SD {setdash} def\n/GS {gsave} def\n/GR {grestore} def\n")
+    f.write("GS\n%d %d scale\n" % (width, height))
+    for c in range(ncurves):
+        # Sum of a few sines, plus straight stretches (a clipped curve, or a step)
+        waves = [(rnd.uniform(0.5, 4.0), rnd.uniform(0, 6.3), rnd.uniform(0.02, 0.2)) for k in range(3)]
+        offset = rnd.uniform(0.3, 0.7)
+        f.write("n\n0.000 0.000 0.000 SRGB\n[] 0 SD\n0.0015 SLW\n")
+        for k in range(npoints):
+            x = float(k) / (npoints - 1)
+            y = offset + sum(a * math.sin(2 * math.pi * w * x + p) for w, p, a in waves)
+            y = min(0.95, max(0.05, y))
+            f.write("%.4f %.4f %s\n" % (x, y, 'm' if k == 0 else 'l'))
+        f.write("s\n")
+    f.write("GR\n")
+    for label in labels:
+        f.write("%.2f %.2f m\n(%s) show\n" % (rnd.uniform(0, width), rnd.uniform(0, height), label))
+    f.write("showpage\n%%EOF\n")
+    f.close()
+    return labels
+
+
+def make_subs(path, labels, extra=0):
+    """ Writes a substitution file with an entry for every label, plus extra entries for labels that
+        are not in the figure.
+    """
+    f = open(path, 'w')
+    f.write("% BEGIN INFO\n% END INFO\n% BEGIN PS\n")
+    for k, label in enumerate(labels):
+        f.write("\\psfrag{%s}[c][c]{$\\displaystyle x_{%d}$} %%EndPs\n" % (label, k))
+    for k in range(extra):
+        f.write("\\psfrag{unused%d}[][]{$y_{%d}$} %%EndPs\n" % (k, k))
+    f.write("% END PS\n")
+    f.close()
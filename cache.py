@@ -0,0 +1,143 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import shutil
+import hashlib
+import tempfile
+import logging
+
+logging.getLogger('cache').addHandler(logging.NullHandler())
+
+""" Content-addressed cache of rendered outputs. Entries are keyed by a hash of everything that
+    determines the result (eps file, substitutions, preamble, output options) and evicted in LRU order.
+"""
+
+
+def default_cachedir():
+    base = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(base, 'pypsfrag')
+
+
+class RenderCache:
+    def __init__(self, cachedir=None, maxsize=200):
+        """ :param cachedir: directory where the entries are stored.
+            :param maxsize: size cap of the cache in MB.
+        """
+        self.logger = logging.getLogger('cache.RenderCache')
+        if cachedir is None:
+            cachedir = default_cachedir()
+        self.cachedir = cachedir
+        self.maxsize = int(maxsize * 1024 * 1024)
+        if not os.path.isdir(self.cachedir):
+            try:
+                os.makedirs(self.cachedir)
+            except OSError:
+                # Another process may have created it in the meantime
+                if not os.path.isdir(self.cachedir):
+                    raise
+        self.logger.debug("Render cache at %s (max %d MB)" % (self.cachedir, maxsize))
+
+    @staticmethod
+    def key(files, *items):
+        """ Computes the key of an entry from the content of files and any other string items."""
+        h = hashlib.sha1()
+        for path in files:
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+        for item in items:
+            item = str(item)
+            h.update(('%d:' % len(item)).encode('utf-8'))
+            h.update(item.encode('utf-8') if not isinstance(item, bytes) else item)
+        return h.hexdigest()
+
+    def entrydir(self, key):
+        return os.path.join(self.cachedir, key)
+
+    def fetch(self, key, filename, suffixes):
+        """ Copies the cached outputs of entry key to filename + suffix, for each suffix.
+            Returns False (and copies nothing) if the entry is missing or incomplete.
+        """
+        entry = self.entrydir(key)
+        sources = [os.path.join(entry, 'out' + suffix) for suffix in suffixes]
+        if not all(os.path.exists(src) for src in sources):
+            self.logger.debug("Cache miss: %s" % key)
+            return False
+        for src, suffix in zip(sources, suffixes):
+            shutil.copyfile(src, filename + suffix)
+        # Mark the entry as recently used
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        self.logger.info("Outputs of %s taken from the cache." % os.path.basename(filename))
+        return True
+
+    def store(self, key, filename, suffixes):
+        """ Stores the outputs filename + suffix as entry key, then evicts old entries if needed."""
+        entry = self.entrydir(key)
+        if os.path.isdir(entry):
+            return
+        # Fill a temporary directory first, so other processes never see a half written entry
+        tmpdir = tempfile.mkdtemp(prefix='.tmp-', dir=self.cachedir)
+        try:
+            for suffix in suffixes:
+                if not os.path.exists(filename + suffix):
+                    self.logger.debug("Not caching %s: %s%s is missing." % (key, filename, suffix))
+                    return
+                shutil.copyfile(filename + suffix, os.path.join(tmpdir, 'out' + suffix))
+            os.rename(tmpdir, entry)
+            tmpdir = None
+            os.utime(entry, None)
+            self.logger.debug("Stored %s in the cache." % key)
+        except OSError as e:
+            self.logger.debug("Could not store %s: %s" % (key, e))
+        finally:
+            if tmpdir is not None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+        self.evict()
+
+    def entries(self):
+        """ Returns a list of (last use, size, path) of every entry."""
+        entries = []
+        for name in os.listdir(self.cachedir):
+            path = os.path.join(self.cachedir, name)
+            if name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.path.getmtime(path), size, path))
+            except OSError:
+                # Removed by another process
+                continue
+        return entries
+
+    def evict(self):
+        """ Removes the least recently used entries until the cache fits in its size cap."""
+        entries = sorted(self.entries())
+        total = sum(e[1] for e in entries)
+        while entries and total > self.maxsize:
+            mtime, size, path = entries.pop(0)
+            self.logger.debug("Evicting %s (%d bytes)" % (path, size))
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        for mtime, size, path in self.entries():
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,912 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import json
+import mmap
+import time
+import errno
+import shutil
+import hashlib
+import tempfile
+import functools
+from cache import default_cachedir
+from pipeline import Pipeline, PipelineError, PipelineCancelled
+from subsparser import parse_subs, format_entry, new_label, OPTIONS
+from texlog import LatexWatcher, format_diagnostic
+
+import logging
+
+logging.getLogger('core').addHandler(logging.NullHandler())
+# PostScript strings painted with show: (text) show. Escaped parentheses are allowed inside the string.
+PS_SHOW = re.compile(r'\(((?:[^()\\]|\\.)*)\)\s*show\b')
+PS_ESCAPE = re.compile(r'\\([()\\])')
+PS_BBOX = re.compile(r'^%%BoundingBox:[ \t]*(-?[0-9.]+)[ \t]+(-?[0-9.]+)[ \t]+(-?[0-9.]+)[ \t]+(-?[0-9.]+)', re.M)
+# Size of the header and trailer of the eps file where the bounding box is searched
+DSC_WINDOW = 65536
+# Conversion engines: classic (dvi -> ps -> pdf -> pdf-crop -> ps-crop -> eps-crop) and fast (dvips -E)
+ENGINES = ('classic', 'fast')
+# Output formats
+FORMATS = ('eps', 'pdf', 'svg', 'png')
+# Where the scratch directories of the jobs are created, when /dev/shm (tmpfs) is not available
+SCRATCH_FALLBACK = tempfile.gettempdir()
+# Fingerprints of the stages of the last build, in the build directory of every figure
+BUILD_STATE = 'build.json'
+
+
+def default_builddir():
+    """ Root of the build directories (hidden in the cache directory, so it is never evicted)."""
+    return os.path.join(default_cachedir(), '.builds')
+
+
+class Data:
+    def __init__(self, filepath="example.eps", subspath="subs.tex", cwd="./",
+                 pdf=False, svg=False, png=False, density=300):
+        self.logger = logging.getLogger('core.Data')
+
+        # Files (the subs file is optional: None)
+        self.subspath = subspath
+        self.subsfile = os.path.basename(subspath) if subspath else None
+        self.logger.debug('Subs file: %s' % self.subsfile)
+
+        # Files names (without extension)
+        self.subsname = self.subsfile[0:-4] if subspath else None
+        self.logger.debug('Subs file name: %s' % self.subsname)
+        self.ferror = 1
+
+        # Dirs
+        self.subsdir = os.path.dirname(subspath) if subspath else None
+        self.logger.debug('Subs directory: %s' % self.subsdir)
+        self.cwd = cwd
+        self.epscwd = cwd
+
+        # Output format options
+        self.eps = True
+        self.pdf = pdf
+        self.svg = svg
+        self.png = png
+        self.density = density  # Density for png conversion, or list of densities (see densities)
+
+        # List where the tags and substitutions are stored
+        self.labels = [new_label()]
+        # Texts painted in the eps file: {text: [positions in the file]}, and its bounding box
+        self.epstags = {}
+        self.epsbbox = None
+
+        # Paths
+        if filepath is None:
+            self.epspath = None
+            self.epsfile = None
+            self.epsname = None
+            self.epsdir = None
+        else:
+            self.open_epsfile(filepath)
+
+        # Checking files
+        subs = False
+        if subspath:
+            subs = self.check_file(self.subspath, False)
+            self.check_extension(self.subsfile, 'tex')
+
+        # Prepare the subs file to read (tags and replacements)
+        self.subspre = None
+        self.entries = []
+        self.subserrors = []
+        if subs:
+            f2 = open(self.subspath, 'r')
+            self.subs = f2.read()
+            self.logger.debug("Loading labels from %s ..." % self.subsfile)
+            self.tags, self.reps = self.read_subs()
+        else:
+            self.subspre = ["% BEGIN INFO\n% END INFO\n"]
+            self.tags = []
+            self.reps = []
+
+    def densities(self):
+        """ Densities of the png outputs, highest first."""
+        if isinstance(self.density, (list, tuple)):
+            return sorted(set(int(d) for d in self.density), reverse=True)
+        return [int(self.density)]
+
+    def open_epsfile(self, filepath):
+        if filepath[0] == '~':
+            self.logger.debug(filepath)
+            self.epspath = os.path.expanduser(filepath)
+            self.logger.debug(self.epspath)
+        else:
+            self.epspath = filepath
+        self.logger.info("Loading %s ..." % self.epspath)
+        self.epsfile = os.path.basename(self.epspath)
+        self.logger.debug('Eps file: %s' % self.epsfile)
+        self.epsname = self.epsfile[0:-4]
+        self.logger.debug('Eps file name: %s' % self.epsname)
+        self.epsdir = os.path.dirname(self.epspath)
+        self.epscwd = self.epsdir
+        if self.epsdir == "":
+            self.epsdir = "./"
+        self.logger.debug('Eps directory: %s' % self.epsdir)
+        self.check_file(self.epspath)
+        self.ferror = self.check_extension(self.epsfile, 'eps')
+        # Read the tags without loading the whole file in memory
+        self.epstags, self.epsbbox = self.scan_epsfile(self.epspath)
+        self.logger.debug("Found %d different texts in %s." % (len(self.epstags), self.epsfile))
+        self.logger.debug("Bounding box: %s" % str(self.epsbbox))
+
+    @classmethod
+    def scan_epsfile(cls, epspath):
+        """ Memory-maps the eps file and extracts the texts painted with show and the bounding box.
+            Only the pages being scanned are read, so big files do not stay resident in memory.
+        """
+        f = open(epspath, 'rb')
+        try:
+            if os.fstat(f.fileno()).st_size == 0:
+                return {}, None
+            epsmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                return cls.index_tags(epsmap), cls.find_bbox(epsmap)
+            finally:
+                epsmap.close()
+        finally:
+            f.close()
+
+    @staticmethod
+    def find_bbox(epsimage):
+        """ Returns the bounding box (llx, lly, urx, ury) declared in the header of the eps file,
+            or in its trailer when the header says (atend).
+        """
+        for window in (epsimage[:DSC_WINDOW], epsimage[-DSC_WINDOW:]):
+            match = PS_BBOX.search(window)
+            if match:
+                return tuple(float(x) for x in match.groups())
+        return None
+
+    @staticmethod
+    def index_tags(epsimage):
+        """ Scans the eps file once and returns a dictionary with every text painted with show
+            and the positions where it appears.
+        """
+        tags = {}
+        for match in PS_SHOW.finditer(epsimage):
+            tag = PS_ESCAPE.sub(r'\1', match.group(1))
+            tags.setdefault(tag, []).append(match.start())
+        return tags
+
+    def check_file(self, fin, critical=True):
+        self.logger.debug("Checking %s file ..." % fin)
+        if not os.path.exists(fin):
+            if critical:
+                raise IOError('File %s/%s does not exist.' % (self.cwd, fin))
+            else:
+                self.logger.error('File %s/%s does not exist.' % (self.cwd, fin))
+                return False
+        else:
+            return True
+
+    def check_extension(self, fin, extension):
+        self.logger.debug("Checking %s extension ..." % fin)
+        if not fin.endswith(extension):
+            self.logger.error("File %s is not a %s file." % (fin, extension))
+            return 1
+        else:
+            return 0
+
+    def read_subs(self):
+        """ Parses the subs file in a single pass (see subsparser). Malformed entries are reported with
+            their line number and skipped. The complete entries, with the psfrag options, are kept in
+            self.entries.
+            :return: lists of tags and replacements.
+        """
+        info, self.entries, self.subserrors = parse_subs(self.subs)
+        self.subspre = [info] if info else []
+        for number, message in self.subserrors:
+            self.logger.warning("%s:%d: %s" % (self.subsfile, number, message))
+        if not self.entries:
+            self.logger.warning('I did not find any psfrag commands ...')
+        tags = [entry['label'] for entry in self.entries]
+        reps = [entry['latex'] for entry in self.entries]
+        self.logger.debug(tags)
+        self.logger.debug(reps)
+        return tags, reps
+
+    def load_subs_labels(self):
+        """ Copies the entries read from the subs file into the labels list.
+            Returns False when there is nothing to replace.
+        """
+        if not self.entries:
+            return False
+        self.add_labels(self.entries)
+        return True
+
+    def generated_subs(self):
+        """ Substitution file written next to the eps file (subs-<name>.tex), which may be edited by hand."""
+        if self.epspath is None:
+            return None
+        return "%s/subs-%s.tex" % (self.epsdir, self.epsname)
+
+    def watched_paths(self):
+        """ Files the outputs depend on: the eps file, the subs file and the generated substitution file."""
+        return [path for path in (self.epspath, self.subspath, self.generated_subs()) if path]
+
+    def load_subs(self, subspath):
+        """ Reads the substitution file subspath, whose entries replace the labels list."""
+        f = open(subspath, 'r')
+        self.subs = f.read()
+        f.close()
+        self.tags, self.reps = self.read_subs()
+        self.labels = [new_label()]
+        return self.load_subs_labels()
+
+    def reload(self, paths):
+        """ Parses again the watched files in paths (see watched_paths) after they changed: the texts
+            of the eps file, or the entries of the substitution files (the generated one last).
+            :return: list of what was reloaded, 'eps' and/or 'subs'.
+        """
+        paths = set(os.path.abspath(path) for path in paths)
+        reloaded = []
+        if self.epspath and os.path.abspath(self.epspath) in paths:
+            self.open_epsfile(self.epspath)
+            reloaded.append('eps')
+        for subspath in (self.subspath, self.generated_subs()):
+            if subspath and os.path.abspath(subspath) in paths:
+                self.logger.info("Loading labels from %s ..." % subspath)
+                self.load_subs(subspath)
+                if 'subs' not in reloaded:
+                    reloaded.append('subs')
+        return reloaded
+
+    def add_labels(self, entries):
+        """ Appends entries (dictionaries with label, latex and optionally the psfrag options) to the
+            labels list, replacing the initial empty row.
+        """
+        for entry in entries:
+            # Entries decoded from JSON are unicode, the labels (like the files they are written to) are UTF-8
+            entry = dict((str(k), v.encode('utf-8') if isinstance(v, unicode) else v) for k, v in entry.items())
+            row = new_label(**dict((k, v) for k, v in entry.items() if k in ('label', 'latex') + OPTIONS))
+            if entry.get('line'):
+                # Line of the substitution file, to point at it in the diagnostics of latex
+                row['line'] = entry['line']
+            if len(self.labels) == 1 and not self.labels[0]['label']:
+                self.labels[0] = row
+            else:
+                self.labels.append(row)
+
+    def suggest_labels(self, library, project=None):
+        """ Adds to the labels list the replacements found in the substitution library (see
+            library.SubsLibrary) for the texts of the eps file that have no replacement yet.
+            :return: list of the rows added.
+        """
+        present = set(row['label'] for row in self.labels)
+        missing = [tag for tag in self.epstags if tag not in present]
+        suggestions = library.suggest(missing, project)
+        added = []
+        for tag in sorted(suggestions):
+            entry = suggestions[tag]
+            row = new_label(**dict((k, v) for k, v in entry.items() if k != 'project'))
+            if len(self.labels) == 1 and not self.labels[0]['label']:
+                self.labels[0] = row
+            else:
+                self.labels.append(row)
+            added.append(row)
+        if added:
+            self.logger.info("%d replacements suggested by the library." % len(added))
+        return added
+
+
+class PSFrag:
+    def __init__(self, data=None, cache=None, texformat=None):
+        self.logger = logging.getLogger('core.PSFrag')
+        if data is None:
+            self.d = Data()
+        else:
+            self.d = data
+        # Render cache (see cache.RenderCache), None disables it
+        self.cache = cache
+        # Precompiled formats of the preamble (see texformat.FormatCache), None disables them
+        self.texformat = texformat
+        # Conversion engine, one of ENGINES
+        self.engine = 'classic'
+        # Measures of the last job, written to <name>-report.json when profiling
+        self.profile = False
+        self.report = None
+        self.subs_report = None
+        # Running pipeline, its listener (see pipeline.Pipeline) and whether the job was cancelled
+        self.pipeline = None
+        self.listener = None
+        self.cancelled = False
+        # With scratch, the job works in a private directory (see make_scratch) instead of the
+        # directory of the eps file, and the outputs stay there until collect()
+        self.scratch = False
+        self.workdir = None
+        # With a build root, the job works in a build directory of the figure under it (see make_builddir)
+        # that keeps the intermediate files, and only the stages whose inputs changed are run again
+        self.buildroot = None
+        self.builddir = None
+        # Refuse to compile unless 'all' the tags, or 'any' of them, are in the eps file (see validate)
+        self.require = None
+        # Tolerance (points) of the pre-optimization of the eps file before latex (see epsopt), None
+        # disables it, and measures of the last one (and of every eps file of a combined document, by
+        # path without extension)
+        self.optimize = None
+        self.optimization = None
+        self.optimizations = {}
+        # Entry written at every line of the subs file, and errors of the last latex run (see texlog)
+        self.subslines = {}
+        self.watcher = None
+        self.diagnostics = []
+
+        # Basic configuration for LaTeX
+        self.preamble = "\\documentclass[a4paper]{article}\n" \
+                        "\\usepackage{graphicx, psfrag}\n"
+        self.begin = "\\begin{document}\n" \
+                     "\\pagestyle{empty}\n"
+        # One figure per page: substitutions file and eps file (without extension)
+        self.figure = "\\begin{figure}[htbp]\n" \
+                      "\\input{%s}\n" \
+                      "\\centerline{\\includegraphics[width=\\textwidth]{%s.eps}}\n" \
+                      "\\end{figure}\n"
+        self.ending = "\\end{document}"
+
+        self.subsname = None
+        # Intermediate files of the conversion, removed when it finishes
+        self.intermediates = ['.dvi', '.aux', '.log', '.ps', '.pdf', '-crop.pdf', '-crop.ps', '-crop.eps',
+                              '-opt.eps']
+
+    def set_packages(self, packages):
+        """ Adds the LaTeX packages to the preamble."""
+        if packages:
+            self.preamble += "\\usepackage{%s}\n" % ", ".join(packages)
+
+    def latex_format(self):
+        """ Path of the precompiled format of the preamble, or None if it is not available."""
+        if self.texformat is None:
+            return None
+        return self.texformat.get(self.preamble)
+
+    def check_tag(self, index):
+        tag = self.d.labels[index]['label']
+        self.logger.debug("Searching for %s ..." % tag)
+        # Look the tag up in the index of the eps file
+        positions = self.d.epstags.get(tag, [])
+        self.logger.debug("%s appears %d times." % (tag, len(positions)))
+        return len(positions) > 0
+
+    def check_labels(self):
+        """ Checks every entry of the labels list against the index of the eps file in one pass.
+            :return: sorted lists of the entries whose tag is not in the eps file (missing), and of
+                     the texts of the eps file without entry (unused).
+        """
+        tags = set(row['label'] for row in self.d.labels if row['label'])
+        missing = sorted(tag for tag in tags if tag not in self.d.epstags)
+        unused = sorted(text for text in self.d.epstags if text not in tags)
+        return missing, unused
+
+    def validate(self):
+        """ Reports the missing and unused tags (see check_labels) before compiling. ValueError is
+            raised when self.require is not fulfilled: 'all' (every entry must be found in the eps
+            file) or 'any' (at least one must be found).
+            :return: missing and unused tags.
+        """
+        missing, unused = self.check_labels()
+        found = len(set(row['label'] for row in self.d.labels if row['label'])) - len(missing)
+        name = self.d.epsfile
+        self.logger.info("%s: %d tags found, %d missing, %d texts without replacement."
+                         % (name, found, len(missing), len(unused)))
+        for tag in missing:
+            self.logger.warning("%s: tag %s not found." % (name, tag))
+        for text in unused:
+            self.logger.debug("%s: text %s has no replacement." % (name, text))
+        if self.require == 'all' and missing:
+            raise ValueError("%d tags not found in %s: %s" % (len(missing), name, ", ".join(missing)))
+        if self.require == 'any' and not found:
+            raise ValueError("none of the tags is in %s" % name)
+        return missing, unused
+
+    def make_scratch(self):
+        """ Creates the private directory of the job, in memory (/dev/shm) when possible, with a link
+            to the eps file. Jobs of the same figure do not share any file.
+        """
+        root = '/dev/shm' if os.access('/dev/shm', os.W_OK) else SCRATCH_FALLBACK
+        self.workdir = tempfile.mkdtemp(prefix='pypsfrag-%s-' % self.d.epsname, dir=root)
+        os.symlink(os.path.abspath(self.d.epspath), "%s/%s.eps" % (self.workdir, self.d.epsname))
+        self.logger.debug("Working in %s ..." % self.workdir)
+
+    def make_builddir(self):
+        """ Creates (or reuses) the build directory of the figure, named after the eps file and a hash
+            of its path, with a link to the eps file.
+        """
+        epspath = os.path.abspath(self.d.epspath)
+        digest = hashlib.sha1(epspath.encode('utf-8')).hexdigest()[:10]
+        self.builddir = os.path.join(self.buildroot, '%s-%s' % (self.d.epsname, digest))
+        if not os.path.isdir(self.builddir):
+            os.makedirs(self.builddir)
+        link = "%s/%s.eps" % (self.builddir, self.d.epsname)
+        if not os.path.islink(link) or os.readlink(link) != epspath:
+            if os.path.lexists(link):
+                os.remove(link)
+            os.symlink(epspath, link)
+        self.logger.debug("Building in %s ..." % self.builddir)
+
+    def load_fingerprints(self):
+        """ Fingerprints of the stages of the last build of the figure (see pipeline.Pipeline.plan)."""
+        try:
+            f = open(os.path.join(self.builddir, BUILD_STATE))
+            try:
+                return json.load(f)
+            finally:
+                f.close()
+        except (IOError, ValueError):
+            return {}
+
+    def save_fingerprints(self, pipeline):
+        statename = os.path.join(self.builddir, BUILD_STATE)
+        f = open(statename + '.tmp', 'w')
+        json.dump(pipeline.fingerprints(), f, indent=2, sort_keys=True)
+        f.close()
+        os.rename(statename + '.tmp', statename)
+
+    def jobdir(self):
+        """ Directory where the files of the job are written."""
+        if self.buildroot is not None:
+            if self.builddir is None:
+                self.make_builddir()
+            return self.builddir
+        if self.scratch:
+            if self.workdir is None:
+                self.make_scratch()
+            return self.workdir
+        return self.d.epsdir
+
+    def collect(self, destdir=None, inmemory=False):
+        """ Takes the outputs out of the scratch directory and removes it, or copies them out of the
+            build directory, which is kept.
+            :param destdir: where the outputs are moved (the directory of the eps file by default).
+                            Each output is renamed into place, so it appears complete or not at all.
+            :param inmemory: read the outputs instead, nothing is written.
+            :return: dictionary {suffix: path}, or {suffix: contents} with inmemory.
+        """
+        if not self.scratch and self.buildroot is None:
+            return dict((sfx, "%s/%s%s" % (self.d.epsdir, self.d.epsname, sfx)) for sfx in self.output_suffixes())
+        destdir = destdir or self.d.epsdir
+        outputs = {}
+        try:
+            for sfx in self.output_suffixes():
+                source = "%s/%s%s" % (self.jobdir(), self.d.epsname, sfx)
+                if inmemory:
+                    f = open(source, 'rb')
+                    outputs[sfx] = f.read()
+                    f.close()
+                elif self.buildroot is not None:
+                    # The build directory keeps its copy for the next build
+                    outputs[sfx] = "%s/%s%s" % (destdir, self.d.epsname, sfx)
+                    self.copy_atomic(source, outputs[sfx])
+                else:
+                    outputs[sfx] = "%s/%s%s" % (destdir, self.d.epsname, sfx)
+                    self.move_atomic(source, outputs[sfx])
+        finally:
+            self.cleanup()
+        return outputs
+
+    @classmethod
+    def move_atomic(cls, source, target):
+        try:
+            os.rename(source, target)
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+            # Other filesystem: copy next to the target and rename
+            cls.copy_atomic(source, target)
+
+    @staticmethod
+    def copy_atomic(source, target):
+        fd, tmpname = tempfile.mkstemp(prefix='.%s.' % os.path.basename(target), dir=os.path.dirname(target))
+        os.close(fd)
+        try:
+            shutil.copyfile(source, tmpname)
+            os.chmod(tmpname, 0o644)
+            os.rename(tmpname, target)
+        except (IOError, OSError):
+            os.remove(tmpname)
+            raise
+
+    def cleanup(self):
+        """ Removes the scratch directory of the job, if any (build directories are kept)."""
+        if self.workdir is not None:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+            self.workdir = None
+
+    def create_subs(self):
+        t0 = time.time()
+        filename = "%s/subs-%s.tex" % (self.jobdir(), self.d.epsname)
+        self.subsname = filename
+        self.logger.debug("Writing substitution file in %s ..." % filename)
+        f = open(filename, 'w')
+        if self.d.subspre:
+            f.write(self.d.subspre[0])
+        else:
+            f.write("% BEGIN INFO\n")
+            f.write("% END INFO\n")
+            self.logger.warning("Something is not going ok with %s ..." % filename)
+            self.logger.warning("There are no tags to replace ...")
+        f.write("% BEGIN PS\n")
+        self.subslines = {}
+        number = (self.d.subspre[0].count("\n") if self.d.subspre else 2) + 2
+        for row in self.d.labels:
+            text = format_entry(row)
+            f.write(text)
+            self.subslines[number] = row
+            number += text.count("\n")
+        f.write("% END PS\n")
+        f.close()
+        self.subs_report = {'stage': 'subs', 'command': None, 'status': 'ok', 'exit_code': 0,
+                            'wall_time': time.time() - t0, 'cpu_time': None,
+                            'output_size': os.path.getsize(filename)}
+        self.logger.debug("Writing Done!")
+
+    def output_suffixes(self):
+        """ Suffixes of the output files that will be created with the selected formats."""
+        formats = (('eps', self.d.eps), ('pdf', self.d.pdf), ('svg', self.d.svg))
+        suffixes = ['-latex.%s' % ext for ext, selected in formats if selected]
+        if self.d.png:
+            suffixes += self.png_suffixes()
+        return suffixes
+
+    def png_suffixes(self):
+        """ Suffix of the png output for every density, highest first: -latex.png with a single density,
+            -latex-<density>.png with several.
+        """
+        densities = self.d.densities()
+        if len(densities) == 1:
+            return ['-latex.png']
+        return ['-latex-%d.png' % density for density in densities]
+
+    def cache_key(self):
+        """ Key of the render cache: eps and substitutions content, preamble and output options."""
+        return self.cache.key([self.d.epspath, self.subsname], self.preamble, self.begin, self.figure,
+                              self.ending, self.engine, self.output_suffixes(), self.d.densities(), self.optimize)
+
+    def eps_reference(self, filename):
+        """ Eps file (without extension) included in the latex document for the figure filename: its
+            optimized copy when the eps files are pre-optimized.
+        """
+        return filename if self.optimize is None else '%s-opt' % filename
+
+    def optimize_eps(self, filename, tolerance):
+        """ Writes filename-opt.eps, the pre-optimized copy of filename.eps (see epsopt). The original
+            is copied instead if the texts painted with show are not exactly the same in both.
+        """
+        source, target = '%s.eps' % filename, '%s-opt.eps' % filename
+        # Only imported by the jobs that optimize
+        from epsopt import EpsOptimizer
+        stats = EpsOptimizer(tolerance).optimize(source, target)
+        tags = dict((tag, len(positions)) for tag, positions in Data.scan_epsfile(source)[0].items())
+        if dict((tag, len(positions)) for tag, positions in Data.scan_epsfile(target)[0].items()) != tags:
+            self.logger.warning("The optimization of %s changed its labels, using the original file." % source)
+            shutil.copyfile(source, target)
+            stats['output_size'] = stats['input_size']
+            stats['failed'] = True
+        self.logger.info("%s optimized in %.2f s: %d -> %d KB, %d of %d segments and %d graphics state "
+                         "operations removed." % (os.path.basename(source), stats['time'], stats['input_size'] / 1024,
+                                                  stats['output_size'] / 1024, stats['segments_removed'],
+                                                  stats['segments'],
+                                                  stats['settings_removed'] + stats['newpaths_removed']))
+        self.optimization = self.optimizations[filename] = stats
+
+    def write_latex(self, latexname, figures):
+        """ Writes the latex document, with a page for every (subs file, eps file without extension)
+            in figures.
+        """
+        self.logger.debug("Writing latex file in %s ..." % latexname)
+        f = open(latexname, 'w')
+        f.write(self.preamble)
+        f.write(self.begin)
+        f.write("\\clearpage\n".join(self.figure % figure for figure in figures))
+        f.write(self.ending)
+        f.close()
+        self.logger.debug("Writing Done!")
+
+    def build_pipeline(self, filedir, filename, latexname):
+        """ Builds the stage graph of the conversion. The svg, png, pdf and eps outputs only
+            depend on the cropped pdf, so they run at the same time.
+        """
+        pipeline = Pipeline(self.d.epsname)
+        self.add_document_stages(pipeline, filedir, filename, latexname, [filename])
+        return pipeline
+
+    def add_document_stages(self, pipeline, filedir, docname, latexname, filenames, sources=None):
+        """ Stages that compile latexname into docname.dvi and convert it, with the selected engine,
+            into the outputs filenames[k]-latex.* of every figure (page k + 1 of the document).
+            The output of latex is parsed while it runs, and the job stops at the first error.
+            :param sources: substitution files of the figures, as in texlog.LatexWatcher (by default,
+                            the one written by create_subs).
+        """
+        fmt = self.latex_format()
+        fmtarg = [] if fmt is None else ['-fmt=%s' % fmt]
+        if sources is None:
+            sources = {self.subsname: self.subslines}
+        self.watcher = LatexWatcher(sources)
+        # Long lines, so that the messages are not wrapped
+        env = dict(os.environ, max_print_line='1000')
+        pages = [None] if len(filenames) == 1 else range(1, len(filenames) + 1)
+        # The eps files are pre-optimized before latex, which includes the optimized copies
+        deps = []
+        if self.optimize is not None:
+            for filename, page in zip(filenames, pages):
+                name = 'optimize' + ('' if page is None else ':%d' % page)
+                pipeline.add(name, functools.partial(self.optimize_eps, filename, self.optimize),
+                             outputs=['%s-opt.eps' % filename], inputs=['%s.eps' % filename])
+                deps.append(name)
+        inputs = [latexname] + sorted(sources)
+        if self.optimize is None:
+            inputs += ['%s.eps' % filename for filename in filenames]
+        pipeline.add('latex', ['latex'] + fmtarg + ['-output-directory=%s' % filedir, '-shell-escape',
+                                                    '-interaction=nonstopmode', '-halt-on-error', '-file-line-error',
+                                                    latexname], deps,
+                     outputs=['%s.dvi' % docname], watch=self.watcher, env=env, inputs=inputs)
+        if self.engine == 'fast':
+            for filename, page in zip(filenames, pages):
+                self.add_fast_stages(pipeline, docname, filename, page)
+        else:
+            self.add_crop_stages(pipeline, docname)
+            for filename, page in zip(filenames, pages):
+                self.add_output_stages(pipeline, '%s-crop.pdf' % docname, filename, page)
+
+    @staticmethod
+    def add_crop_stages(pipeline, filename):
+        """ Classic engine: dvips -> ps2pdf -> pdfcrop, that create filename-crop.pdf."""
+        pipeline.add('dvips', ['dvips', '-q', '-o', '%s.ps' % filename, '%s.dvi' % filename], ['latex'],
+                     outputs=['%s.ps' % filename])
+        pipeline.add('ps2pdf', ['ps2pdf', '%s.ps' % filename, '%s.pdf' % filename], ['dvips'],
+                     outputs=['%s.pdf' % filename])
+        pipeline.add('pdfcrop', ['pdfcrop', '--noverbose', '%s.pdf' % filename, '%s-crop.pdf' % filename],
+                     ['ps2pdf'], outputs=['%s-crop.pdf' % filename])
+
+    def add_fast_stages(self, pipeline, docname, filename, page=None):
+        """ Fast engine: dvips -E writes the eps with its tight bounding box straight from the dvi, and
+            the cropped pdf is only created (from that eps) when pdf, svg or png outputs are selected.
+        """
+        sfx = '' if page is None else ':%d' % page
+        pages = [] if page is None else ['-pp', '%d' % page]
+        epsout = '%s-latex.eps' % filename if self.d.eps else '%s-crop.eps' % filename
+        pipeline.add('dvips' + sfx, ['dvips', '-E', '-q'] + pages + ['-o', epsout, '%s.dvi' % docname],
+                     ['latex'], outputs=[epsout])
+        if self.d.pdf or self.d.svg or self.d.png:
+            pipeline.add('epstopdf' + sfx, ['ps2pdf', '-dEPSCrop', epsout, '%s-crop.pdf' % filename],
+                         ['dvips' + sfx], outputs=['%s-crop.pdf' % filename])
+            self.add_output_stages(pipeline, '%s-crop.pdf' % filename, filename, None, 'epstopdf' + sfx, sfx,
+                                   eps=False)
+
+    def add_output_stages(self, pipeline, croppdf, filename, page=None, dep='pdfcrop', sfx=None, eps=None):
+        """ Stages that create the selected outputs filename-latex.* from the cropped pdf, or from
+            one of its pages. Stage names get the page number (or sfx) as suffix, so several figures
+            fit in the same pipeline.
+        """
+        if sfx is None:
+            sfx = '' if page is None else ':%d' % page
+        if eps is None:
+            eps = self.d.eps
+        if eps:
+            pages = [] if page is None else ['-f', '%d' % page, '-l', '%d' % page]
+            pipeline.add('pdftops' + sfx, ['pdftops', '-q'] + pages + [croppdf, '%s-crop.ps' % filename], [dep],
+                         outputs=['%s-crop.ps' % filename])
+            pipeline.add('ps2eps' + sfx, ['ps2eps', '-q', '-f', '%s-crop.ps' % filename], ['pdftops' + sfx],
+                         outputs=['%s-crop.eps' % filename])
+            pipeline.add('eps' + sfx, lambda: shutil.copyfile('%s-crop.eps' % filename, '%s-latex.eps' % filename),
+                         ['ps2eps' + sfx], outputs=['%s-latex.eps' % filename])
+        if self.d.svg:
+            pages = [] if page is None else ['%d' % page]
+            pipeline.add('pdf2svg' + sfx, ['pdf2svg', croppdf, '%s-latex.svg' % filename] + pages, [dep],
+                         outputs=['%s-latex.svg' % filename])
+        if self.d.png:
+            # Rasterized once, at the highest density, and downscaled to the others
+            source = croppdf if page is None else '%s[%d]' % (croppdf, page - 1)
+            densities = self.d.densities()
+            pngs = [filename + suffix for suffix in self.png_suffixes()]
+            pipeline.add('convert' + sfx, ['convert', '-density', '%d' % densities[0], source, pngs[0]], [dep],
+                         outputs=[pngs[0]])
+            for density, png in zip(densities[1:], pngs[1:]):
+                pipeline.add('resize-%d' % density + sfx,
+                             ['convert', pngs[0], '-resize', '%.4f%%' % (100.0 * density / densities[0]),
+                              '-units', 'PixelsPerInch', '-density', '%d' % density, png],
+                             ['convert' + sfx], outputs=[png])
+        if self.d.pdf:
+            if page is None:
+                pipeline.add('pdf' + sfx, lambda: shutil.copyfile(croppdf, '%s-latex.pdf' % filename), [dep],
+                             outputs=['%s-latex.pdf' % filename])
+            else:
+                pipeline.add('pdf' + sfx, ['pdfseparate', '-f', '%d' % page, '-l', '%d' % page, croppdf,
+                                           '%s-latex.pdf' % filename], [dep], outputs=['%s-latex.pdf' % filename])
+
+    @staticmethod
+    def remove_files(filename, suffixes, keep=()):
+        for suffix in suffixes:
+            if suffix not in keep and os.path.exists(filename + suffix):
+                os.remove(filename + suffix)
+
+    def make_report(self, t0, pipeline=None, stages=None, error=None, cached=False):
+        """ Stores the measures of the job started at t0 (with those of the given stages of the
+            pipeline, or all of them) in self.report, and writes them as JSON when profiling.
+        """
+        measures = [self.subs_report] if self.subs_report else []
+        if pipeline is not None:
+            measures += pipeline.report(stages)
+        subs_time = self.subs_report['wall_time'] if self.subs_report else 0.0
+        self.report = {'file': self.d.epspath,
+                       'engine': self.engine,
+                       'outputs': self.output_suffixes(),
+                       'density': self.d.density,
+                       'cached': cached,
+                       'status': 'ok' if error is None else 'failed',
+                       'error': error,
+                       'wall_time': time.time() - t0 + subs_time,
+                       'optimization': self.optimization,
+                       'stages': measures,
+                       'diagnostics': self.diagnostics}
+        if self.profile:
+            reportname = "%s/%s-report.json" % (self.d.epsdir, self.d.epsname)
+            self.logger.debug("Writing report in %s ..." % reportname)
+            f = open(reportname, 'w')
+            json.dump(self.report, f, indent=2)
+            f.close()
+        return self.report
+
+    def cancel(self):
+        """ Cancels the job from another thread, killing the commands that are running."""
+        self.cancelled = True
+        pipeline = self.pipeline
+        if pipeline is not None:
+            pipeline.cancel()
+
+    def do_replace(self):
+        t0 = time.time()
+        self.diagnostics = []
+        self.optimization = None
+        self.optimizations = {}
+        filedir = self.jobdir()
+        filename = "%s/%s" % (filedir, self.d.epsname)
+        key = None
+        if self.cache is not None:
+            key = self.cache_key()
+            if self.cache.fetch(key, filename, self.output_suffixes()):
+                if self.buildroot is not None:
+                    # The outputs of the build directory no longer match the fingerprints
+                    self.remove_files(os.path.join(filedir, BUILD_STATE), [''])
+                self.make_report(t0, cached=True)
+                self.logger.debug("All jobs finished.")
+                return
+
+        # Create latex file
+        latexname = "%s/%s.tex" % (filedir, self.d.epsname)
+        self.write_latex(latexname, [(self.subsname, self.eps_reference(filename))])
+
+        # Compile latex file and transform dvi -> ps -> pdf -> pdf-crop -> ps-crop -> eps-crop
+        pipeline = self.build_pipeline(filedir, filename, latexname)
+        pipeline.listener = self.listener
+        self.pipeline = pipeline
+        if self.cancelled:
+            pipeline.cancel()
+        # In a build directory, the intermediate files are kept and only the stages downstream of a change run
+        incremental = self.buildroot is not None
+        if incremental and pipeline.plan(self.load_fingerprints()) < len(pipeline.stages):
+            self.logger.info("Up to date: %s." % ", ".join(s.name for s in pipeline.stages if s.uptodate))
+        self.logger.debug("Running %s ..." % ", ".join(s.name for s in pipeline.stages if not s.uptodate))
+        try:
+            pipeline.run()
+        except PipelineCancelled as e:
+            self.logger.warning("Replacement of %s cancelled." % filename)
+            if not incremental:
+                self.remove_files(filename, self.intermediates)
+            # Killed commands may leave truncated outputs
+            for stage in pipeline.stages:
+                if stage.returncode not in (None, 0):
+                    self.remove_files('', stage.outputs)
+            if incremental:
+                self.save_fingerprints(pipeline)
+            self.make_report(t0, pipeline, error=str(e))
+            raise
+        except PipelineError as e:
+            self.logger.error("%s" % e)
+            self.diagnostics = self.watcher.close()
+            for diagnostic in self.diagnostics:
+                if format_diagnostic(diagnostic) not in str(e):
+                    self.logger.error(format_diagnostic(diagnostic))
+            self.logger.debug(e.output)
+            if incremental:
+                self.save_fingerprints(pipeline)
+            else:
+                self.remove_files(filename, self.intermediates, keep=['.log'])
+            self.make_report(t0, pipeline, error=str(e))
+            raise
+        if incremental:
+            self.save_fingerprints(pipeline)
+        else:
+            self.logger.debug("Removing auxiliary files ...")
+            self.remove_files(filename, self.intermediates)
+        if self.d.eps and not self.scratch and not incremental:
+            self.logger.info("New EPS file is %s-latex.eps." % filename)
+
+        if key is not None:
+            self.cache.store(key, filename, self.output_suffixes())
+        self.make_report(t0, pipeline)
+        self.logger.debug("All jobs finished.")
+
+
+def render(epspath, entries, formats=('eps',), subspath=None, density=300, engine='classic', packages=None,
+           cache=None, texformat=None, profile=False, scratch=False, destdir=None, inmemory=False, require=None,
+           optimize=None):
+    """ Replaces the labels of an eps file, without GUI.
+        :param epspath: path of the eps file. The outputs are written next to it (<name>-latex.<ext>).
+        :param entries: replacements, as dictionaries (label, latex and optionally posn, psposn, scale
+                        and rot) or (label, latex) pairs. They are added to those of the subs file.
+        :param formats: output formats, among eps, pdf, svg and png.
+        :param subspath: optional substitution file.
+        :param density: density of the png output, or list of densities (one png for each).
+        :param cache: cache.RenderCache, or None.
+        :param texformat: texformat.FormatCache, or None.
+        :param scratch: work in a private scratch directory (see PSFrag.make_scratch): the only files
+                        written out of it are the outputs, moved to destdir (default is next to the eps).
+        :param inmemory: work in a scratch directory and return the contents of the outputs instead.
+        :param require: refuse to compile unless 'all' the entries, or 'any' of them, are in the eps
+                        file (see PSFrag.validate).
+        :param optimize: tolerance (points) of the pre-optimization of the eps file (see epsopt), None
+                         disables it.
+        :return: dictionary with ok, outputs (paths), error, elapsed (s), report (measures of every
+                 stage) and diagnostics (errors of latex, see texlog). With inmemory, outputs is empty
+                 and data holds the contents by format.
+    """
+    t0 = time.time()
+    psfrag = None
+    try:
+        unknown = [ext for ext in formats if ext not in FORMATS]
+        if unknown:
+            raise ValueError("unknown formats: %s" % ", ".join(unknown))
+        if engine not in ENGINES:
+            raise ValueError("unknown engine: %s" % engine)
+        data = Data(epspath, subspath, os.path.dirname(epspath) or "./",
+                    'pdf' in formats, 'svg' in formats, 'png' in formats, density)
+        data.eps = 'eps' in formats
+        if data.ferror:
+            raise ValueError("%s is not an .eps file" % epspath)
+        data.load_subs_labels()
+        data.add_labels([e if isinstance(e, dict) else {'label': e[0], 'latex': e[1]} for e in entries])
+        if not data.labels[0]['label']:
+            raise ValueError("no substitutions to be made")
+        psfrag = PSFrag(data, cache, texformat)
+        psfrag.set_packages(packages)
+        psfrag.engine = engine
+        psfrag.profile = profile
+        psfrag.scratch = scratch or inmemory
+        psfrag.require = require
+        psfrag.optimize = optimize
+        psfrag.validate()
+        psfrag.create_subs()
+        psfrag.do_replace()
+        outputs = psfrag.collect(destdir, inmemory)
+    except (PipelineError, IOError, OSError, ValueError) as e:
+        if psfrag is not None:
+            psfrag.cleanup()
+        return {'ok': False, 'outputs': [], 'error': str(e), 'elapsed': time.time() - t0,
+                'report': psfrag.report if psfrag else None, 'diagnostics': psfrag.diagnostics if psfrag else []}
+    result = {'ok': True, 'outputs': [], 'error': None, 'elapsed': time.time() - t0, 'report': psfrag.report,
+              'diagnostics': []}
+    if inmemory:
+        # png, or 72.png, 150.png, ... with several densities
+        result['data'] = dict((sfx[len('-latex') + 1:], contents) for sfx, contents in outputs.items())
+    else:
+        result['outputs'] = [outputs[sfx] for sfx in psfrag.output_suffixes()]
+    return result
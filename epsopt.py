@@ -0,0 +1,512 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import math
+import time
+import shutil
+
+import logging
+
+logging.getLogger('epsopt').addHandler(logging.NullHandler())
+
+""" Streaming pre-optimization of the eps files written by plotting programs, before they go through
+    the LaTeX toolchain. The file is read line by line, in constant memory, and only three kinds of
+    lines are changed:
+    - x y lineto (or rlineto) lines inside straight stretches of a path: the points closer than the
+      tolerance to the segment that replaces them are removed,
+    - graphics state settings (setlinewidth, setrgbcolor, setdash, ...) with literal arguments that
+      repeat the current value,
+    - newpath when there is no current path.
+    Any other line, in particular the texts painted with show, is copied as it is. Lines of procedure
+    bodies, strings and data spanning several lines are never changed, and code whose effect is not
+    known makes the optimizer forget what it knew about the graphics state.
+"""
+
+# Default tolerance of the path simplification, in points of the eps file (1/72 inch)
+TOLERANCE = 0.1
+# Header of the eps files with a binary preview (DOS eps), which are copied as they are
+DOS_EPS = '\xc5\xd0\xd3\xc6'
+
+NUMBER = re.compile(r'[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?$')
+TOKEN = re.compile(r'\[|\]|<<|>>|[^\s\[\]]+')
+STRING = re.compile(r'\((?:[^()\\]|\\.)*\)|<[0-9a-fA-F\s]*>')
+# Definitions on a single line: /name {body} [bind] def, /name /operator load def, and /name value def
+DEFINITION = re.compile(r'/([^\s/{}()\[\]<>%]+)\s*\{([^{}()%]*)\}\s*(?:bind\s+)?(?:def|_d)\b')
+LOAD_DEFINITION = re.compile(r'/([^\s/{}()\[\]<>%]+)\s*/(\w+)\s+load\s+def\b')
+VALUE_DEFINITION = re.compile(r'/([^\s/{}()\[\]<>%]+)\s+(.*)\s(?:def|_d)$')
+
+POINT_OPS = ('moveto', 'rmoveto', 'lineto', 'rlineto')
+SETTERS = {'setlinewidth': 'width', 'setlinecap': 'cap', 'setlinejoin': 'join', 'setmiterlimit': 'miter',
+           'setdash': 'dash', 'setgray': 'color', 'setrgbcolor': 'color', 'setcmykcolor': 'color',
+           'sethsbcolor': 'color', 'setcolor': 'color'}
+PAINT_OPS = ('stroke', 'fill', 'eofill', 'newpath')
+PATH_OPS = ('moveto', 'rmoveto', 'lineto', 'rlineto', 'curveto', 'rcurveto', 'arc', 'arcn', 'arct', 'closepath')
+# Operators that change neither the settings, nor the scale of the user space, nor the path
+NEUTRAL_OPS = ('clip', 'eoclip', 'show', 'ashow', 'widthshow', 'awidthshow', 'kshow', 'xshow', 'yshow', 'xyshow',
+               'glyphshow', 'stringwidth', 'findfont', 'scalefont', 'setfont', 'selectfont', 'makefont',
+               'translate', 'rotate', 'def', 'load', 'bind', 'begin', 'end', 'dict', 'exch', 'pop', 'dup',
+               'index', 'copy', 'roll', 'currentpoint', 'currentmatrix', 'currentdict', 'matrix', 'array', 'string',
+               'length', 'get', 'put', 'known', 'where', 'store', 'definefont', 'mul', 'div', 'add', 'sub', 'neg',
+               'eq', 'ne', 'not', 'and', 'or', 'true', 'false', 'null', 'showpage')
+SAVE_OPS = ('gsave', 'save')
+RESTORE_OPS = ('grestore', 'restore')
+BUILTINS = set(POINT_OPS + tuple(SETTERS) + PAINT_OPS + PATH_OPS + NEUTRAL_OPS + SAVE_OPS + RESTORE_OPS +
+               ('scale', 'concat', 'setcolorspace'))
+# Operators that change the scale of the user space, or the graphics state stack
+TRANSFORM_OPS = ('scale', 'concat', 'setmatrix', 'initmatrix', 'initgraphics', 'gsave', 'grestore', 'grestoreall',
+                 'save', 'restore', 'setpagedevice', 'exec')
+
+
+def decimals(number):
+    point = number.find('.')
+    return 0 if point < 0 else len(number) - point - 1
+
+
+def format_number(value, ndigits):
+    text = '%.*f' % (ndigits, value)
+    if text.startswith('-') and float(text) == 0:
+        text = text[1:]
+    return text
+
+
+class Stretch:
+    def __init__(self, op, relative, anchor, absolute):
+        """ Consecutive lineto (or rlineto) operations being simplified, from anchor, the last point
+            written. The points after it are dropped while the segment from the anchor to the last one
+            passes at most at tolerance from all of them: every point at distance r from the anchor
+            allows the directions of the segment within asin(tolerance / r) of its own direction, and
+            the segment must reach the farthest point (the sleeve of Zhao and Saalfeld).
+            :param op: name of the operator in the file.
+            :param absolute: whether the anchor is in the coordinates of the file, or in coordinates of
+                             its own for a relative stretch from an unknown current point.
+        """
+        self.op = op
+        self.relative = relative
+        self.absolute = absolute
+        # Point drawn at the anchor, which differs from it by rounding once relative points are merged
+        self.drawn = anchor
+        self.restart(anchor)
+
+    def restart(self, anchor):
+        self.anchor = anchor
+        # Last point (x, y, line), number of points and largest number of decimals since the anchor
+        self.last = None
+        self.count = 0
+        self.ndigits = 0
+        # Allowed directions [low, high], relative to the direction theta of the first point farther
+        # than the tolerance (None before it), and distance of the farthest point
+        self.theta = None
+        self.low = self.high = 0.0
+        self.reach = 0.0
+
+    def polar(self, x, y):
+        """ Distance from the anchor and direction (relative to theta) of the point x, y."""
+        dx, dy = x - self.anchor[0], y - self.anchor[1]
+        angle = math.atan2(dy, dx) - (self.theta or 0.0)
+        if angle > math.pi:
+            angle -= 2 * math.pi
+        elif angle < -math.pi:
+            angle += 2 * math.pi
+        return math.hypot(dx, dy), angle
+
+    def fits(self, r, angle):
+        """ Whether the segment from the anchor to the point at r, angle (see polar) passes close enough
+            to the points since the anchor.
+        """
+        return r >= self.reach and (self.theta is None or self.low <= angle <= self.high)
+
+    def add(self, r, angle, x, y, line, ndigits, tolerance):
+        if r > tolerance:
+            spread = math.asin(tolerance / r)
+            if self.theta is None:
+                self.theta = angle
+                self.low, self.high = -spread, spread
+            else:
+                self.low, self.high = max(self.low, angle - spread), min(self.high, angle + spread)
+        self.reach = max(self.reach, r)
+        self.last = (x, y, line)
+        self.count += 1
+        self.ndigits = max(self.ndigits, ndigits)
+
+
+class EpsOptimizer:
+    def __init__(self, tolerance=TOLERANCE):
+        """ :param tolerance: largest distance (in points of the eps file) between a removed point and
+                              the simplified path. With 0 only the points on a straight line are removed.
+        """
+        self.logger = logging.getLogger('epsopt.EpsOptimizer')
+        self.tolerance = tolerance
+        # Builtin operators executed by every name (None when unknown), and whether the procedures
+        # defined in the file may change the scale of the user space or the graphics state stack
+        self.aliases = dict((op, [op]) for op in BUILTINS)
+        self.transforms = {}
+        # Current value of the settings ({kind: (operator, arguments)}), scale of the user space (None
+        # when unknown), current point (None when unknown), whether the current path is empty, and the
+        # settings and scale saved by gsave
+        self.known = {}
+        self.scale = 1.0
+        self.current = None
+        self.empty = True
+        self.stack = []
+        # Straight stretch being simplified (see Stretch)
+        self.run = None
+        # Depth of strings and procedure bodies at the end of the last line, name and tokens of the
+        # procedure spanning several lines, name alone on the last line, and raw copy mode (the line
+        # that ends it, or 'rest')
+        self.parens = 0
+        self.braces = 0
+        self.block = None
+        self.block_tokens = set()
+        self.literal = None
+        self.raw = None
+        self.out = None
+        self.stats = {'input_size': 0, 'output_size': 0, 'segments': 0, 'segments_removed': 0,
+                      'settings_removed': 0, 'newpaths_removed': 0, 'time': 0.0}
+
+    def optimize(self, src, dst):
+        """ Writes the optimized copy of the eps file src in dst.
+            :return: dictionary with the sizes of both files, the lineto segments read and removed,
+                     the graphics state operations removed and the time spent.
+        """
+        t0 = time.time()
+        fin = open(src, 'rb')
+        self.out = open(dst, 'wb')
+        try:
+            if fin.read(4) == DOS_EPS:
+                fin.seek(0)
+                shutil.copyfileobj(fin, self.out)
+            else:
+                fin.seek(0)
+                for line in fin:
+                    self.feed(line)
+                self.flush()
+        finally:
+            fin.close()
+            self.out.close()
+        self.stats['input_size'] = os.path.getsize(src)
+        self.stats['output_size'] = os.path.getsize(dst)
+        self.stats['time'] = time.time() - t0
+        return self.stats
+
+    def feed(self, line):
+        if self.raw is not None:
+            self.flush()
+            self.out.write(line)
+            if self.raw != 'rest' and line.startswith(self.raw):
+                self.raw = None
+            return
+        if self.parens or self.braces:
+            # Inside a string or a procedure body spanning several lines
+            self.out.write(line)
+            self.block_tokens.update(TOKEN.findall(STRING.sub(' ', line).split('%')[0]))
+            self.scan(line)
+            if not self.parens and not self.braces:
+                self.close_block(line)
+            return
+        literal, self.literal = self.literal, None
+        stripped = line.strip()
+        if not stripped or stripped.startswith('%'):
+            if stripped.startswith('%%BeginBinary') or stripped.startswith('%%BeginData'):
+                self.flush()
+                self.raw = '%%EndBinary' if stripped.startswith('%%BeginBinary') else '%%EndData'
+            self.out.write(line)
+            return
+        parts = TOKEN.findall(stripped) if '[' in stripped or ']' in stripped else stripped.split()
+        if len(parts) == 3 and self.point_line(parts, line):
+            return
+        self.flush()
+        if 'currentfile' in stripped:
+            # Inline data follows, of unknown extent: the rest of the file is copied as it is
+            self.raw = 'rest'
+            self.out.write(line)
+            return
+        if '(' in line or ')' in line or '{' in line or '}' in line:
+            self.out.write(line)
+            self.complex_line(line, stripped, literal)
+            return
+        if len(parts) == 1 and parts[0].startswith('/'):
+            # Name of a procedure whose body starts on the next line
+            self.literal = parts[0][1:]
+        elif len(parts) == 2 and parts[0].startswith('/') and parts[1] in ('[', '<<'):
+            # Array or dictionary spanning several lines
+            self.define(parts[0][1:], [], [])
+        match = LOAD_DEFINITION.match(stripped)
+        if match:
+            self.define(match.group(1), self.aliases.get(match.group(2)), [match.group(2)])
+            self.out.write(line)
+            return
+        match = VALUE_DEFINITION.match(stripped)
+        if match:
+            # Executing the name pushes the value
+            tokens = TOKEN.findall(match.group(2))
+            self.execute(self.operators(tokens), tokens)
+            self.define(match.group(1), [], [])
+            self.out.write(line)
+            return
+        ops = self.operators(parts)
+        if ops is not None and len(ops) == 1 and ops[0] in SETTERS and self.setting_line(parts, ops[0], line):
+            return
+        if ops == ['newpath'] and self.empty:
+            self.stats['newpaths_removed'] += 1
+            return
+        if ops == ['scale'] and len(parts) == 3 and NUMBER.match(parts[0]) and NUMBER.match(parts[1]):
+            if self.scale is not None:
+                self.scale *= max(abs(float(parts[0])), abs(float(parts[1])))
+        elif ops == ['concat'] and self.concat_line(parts):
+            pass
+        else:
+            self.execute(ops, parts)
+        self.out.write(line)
+
+    def define(self, name, ops, tokens):
+        """ Defines name as a procedure executing the builtin operators ops (None if unknown), from
+            the tokens of its body.
+        """
+        self.aliases[name] = ops
+        self.transforms[name] = self.may_transform(tokens)
+
+    def may_transform(self, tokens):
+        """ Whether executing tokens may change the scale of the user space or the graphics state stack.
+            Names not defined in the file are taken as builtin operators.
+        """
+        return any(self.transforms.get(token, token in TRANSFORM_OPS) for token in tokens)
+
+    def operators(self, tokens):
+        """ Builtin operators executed by tokens (literals are skipped), or None if any is unknown."""
+        ops = []
+        for token in tokens:
+            if token in ('[', ']', '<<', '>>') or token[0] in '/<' or NUMBER.match(token):
+                continue
+            expansion = self.aliases.get(token)
+            if expansion is None:
+                return None
+            ops.extend(expansion)
+        return ops
+
+    def execute(self, ops, tokens):
+        """ Updates the tracked state after the builtin operators ops, executed by tokens. ops is None
+            when their effect is not known.
+        """
+        if ops is None:
+            self.forget(tokens)
+            return
+        for op in ops:
+            if op in SAVE_OPS:
+                self.stack.append((dict(self.known), self.scale))
+            elif op in RESTORE_OPS:
+                self.known, self.scale = self.stack.pop() if self.stack else ({}, None)
+                self.current = None
+                self.empty = False
+            elif op in SETTERS:
+                self.known.pop(SETTERS[op], None)
+            elif op == 'setcolorspace':
+                self.known.pop('color', None)
+            elif op in ('scale', 'concat'):
+                self.scale = None
+            elif op in PAINT_OPS:
+                self.current = None
+                self.empty = True
+            elif op in PATH_OPS:
+                self.current = None
+                self.empty = False
+
+    def forget(self, tokens=None):
+        """ Forgets the settings and the path after code of unknown effect, and also the scale and the
+            saved states when the code (tokens, None if unknown) may change them.
+        """
+        self.known = {}
+        self.current = None
+        self.empty = False
+        if tokens is None or self.may_transform(tokens):
+            self.scale = None
+            self.stack = []
+
+    def scan(self, line):
+        """ Follows the depth of strings and procedure bodies through line."""
+        escaped = False
+        for char in line:
+            if self.parens:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == '(':
+                    self.parens += 1
+                elif char == ')':
+                    self.parens -= 1
+            elif char == '%':
+                break
+            elif char == '(':
+                self.parens = 1
+            elif char == '{':
+                self.braces += 1
+            elif char == '}':
+                self.braces = max(0, self.braces - 1)
+
+    def complex_line(self, line, stripped, literal):
+        """ Lines with strings or procedures: definitions of procedures are recorded, texts and
+            anything else are left as they are, forgetting the state when their effect is not known.
+        """
+        self.scan(line)
+        if self.parens or self.braces:
+            # A procedure spanning several lines, named on this line or on the previous one
+            head = TOKEN.findall(stripped.split('{')[0])
+            self.block = None
+            self.block_tokens = set(TOKEN.findall(STRING.sub(' ', stripped).split('%')[0]))
+            if not self.parens and self.braces == 1:
+                if len(head) == 1 and head[0].startswith('/'):
+                    self.block = head[0][1:]
+                elif not head:
+                    self.block = literal
+            if self.block is None:
+                self.forget(head)
+            return
+        rest = stripped
+        for match in DEFINITION.finditer(rest):
+            tokens = TOKEN.findall(match.group(2))
+            self.define(match.group(1), self.operators(tokens), tokens)
+        rest = DEFINITION.sub(' ', rest)
+        for match in LOAD_DEFINITION.finditer(rest):
+            self.define(match.group(1), self.aliases.get(match.group(2)), [match.group(2)])
+        rest = STRING.sub(' ', LOAD_DEFINITION.sub(' ', rest)).split('%')[0]
+        tokens = TOKEN.findall(rest.replace('{', ' ').replace('}', ' '))
+        if '{' in rest or '}' in rest or '(' in rest or ')' in rest:
+            self.forget(tokens)
+            return
+        self.execute(self.operators(tokens), tokens)
+
+    def close_block(self, line):
+        """ End of a procedure spanning several lines. A definition makes the name unknown from now on.
+            Otherwise what the procedure does is not known, nor what it defines: the state is
+            forgotten, or the rest of the file is copied as it is.
+        """
+        ops = TOKEN.findall(line[line.rfind('}') + 1:].split('%')[0]) if '}' in line else None
+        tokens = [token for token in self.block_tokens if not token.startswith('/')]
+        if self.block is not None and ops in (['def'], ['bind', 'def'], ['_d'], ['bind', '_d']):
+            self.define(self.block, None, tokens)
+        elif not ops or 'def' in ops or '_d' in ops:
+            self.raw = 'rest'
+        else:
+            self.forget(tokens + ops)
+        self.block = None
+        self.block_tokens = set()
+
+    def setting_line(self, parts, op, line):
+        """ Drops the settings with literal arguments that repeat the current value."""
+        kind = SETTERS[op]
+        args = parts[:-1]
+        if not all(arg in ('[', ']') or NUMBER.match(arg) for arg in args):
+            self.known.pop(kind, None)
+            self.out.write(line)
+            return True
+        value = (op, tuple(args))
+        if self.known.get(kind) == value:
+            self.stats['settings_removed'] += 1
+            return True
+        self.known[kind] = value
+        self.out.write(line)
+        return True
+
+    def concat_line(self, parts):
+        """ [a b c d e f] concat: the scale of the user space grows at most by the norm of the matrix."""
+        if len(parts) != 9 or parts[0] != '[' or parts[7] != ']' or not all(NUMBER.match(v) for v in parts[1:7]):
+            return False
+        a, b, c, d = [float(v) for v in parts[1:5]]
+        if self.scale is not None:
+            self.scale *= math.sqrt(a * a + b * b + c * c + d * d)
+        return True
+
+    def point_line(self, parts, line):
+        """ x y moveto/lineto/rmoveto/rlineto lines. Consecutive lineto (or rlineto) form the stretch
+            being simplified.
+        """
+        expansion = self.aliases.get(parts[2])
+        if not expansion or len(expansion) != 1 or expansion[0] not in POINT_OPS:
+            return False
+        if not (NUMBER.match(parts[0]) and NUMBER.match(parts[1])):
+            return False
+        op = expansion[0]
+        x, y = float(parts[0]), float(parts[1])
+        relative = op.startswith('r')
+        self.empty = False
+        if op.endswith('moveto'):
+            self.flush()
+            self.out.write(line)
+            if not relative:
+                self.current = (x, y)
+            elif self.current is not None:
+                self.current = (self.current[0] + x, self.current[1] + y)
+            return True
+        self.stats['segments'] += 1
+        run = self.run
+        if run is not None and (run.op != parts[2] or run.relative != relative):
+            self.flush()
+            run = None
+        if run is None:
+            if self.scale is None or (self.current is None and not relative):
+                # Unknown tolerance or starting point: the point is kept
+                self.out.write(line)
+                self.current = None if relative else (x, y)
+                return True
+            # Relative stretches from an unknown point are simplified in coordinates of their own
+            absolute = self.current is not None
+            run = self.run = Stretch(parts[2], relative, self.current if absolute else (0.0, 0.0), absolute)
+        if relative:
+            last = run.last or run.anchor
+            x, y = last[0] + x, last[1] + y
+        r, angle = run.polar(x, y)
+        if run.count and not run.fits(r, angle):
+            self.emit(run)
+            r, angle = run.polar(x, y)
+        run.add(r, angle, x, y, line, max(decimals(parts[0]), decimals(parts[1])),
+                self.tolerance / self.scale if self.scale else 0.0)
+        return True
+
+    def emit(self, run):
+        """ Writes the last point of the stretch, which becomes the anchor of the next one."""
+        x, y, line = run.last
+        if not run.relative or run.count == 1 and run.drawn == run.anchor:
+            self.out.write(line)
+            run.drawn = (x, y)
+        else:
+            # Relative to the point drawn, so that the rounding errors do not add up
+            dx = format_number(x - run.drawn[0], run.ndigits)
+            dy = format_number(y - run.drawn[1], run.ndigits)
+            self.out.write('%s %s %s%s' % (dx, dy, run.op, line[len(line.rstrip('\r\n')):]))
+            run.drawn = (run.drawn[0] + float(dx), run.drawn[1] + float(dy))
+        self.stats['segments_removed'] += run.count - 1
+        run.restart((x, y))
+
+    def flush(self):
+        """ Ends the stretch being simplified, if any."""
+        run = self.run
+        if run is None:
+            return
+        if run.count:
+            self.emit(run)
+        self.current = run.anchor if run.absolute else None
+        self.run = None
+
+
+def optimize_eps(src, dst, tolerance=TOLERANCE):
+    """ Writes the optimized copy of the eps file src in dst (see EpsOptimizer).
+        :return: dictionary with the measures of the optimization.
+    """
+    return EpsOptimizer(tolerance).optimize(src, dst)
@@ -0,0 +1,266 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import time
+import errno
+import select
+import struct
+import ctypes
+import ctypes.util
+import hashlib
+import threading
+
+import logging
+
+logging.getLogger('filewatch').addHandler(logging.NullHandler())
+
+""" Watches files and reports their changes, once the writes have settled. inotify is used when
+    available (Linux), otherwise the files are polled.
+"""
+
+# inotify events of the watched directories: written, closed after writing, created, or moved into it
+IN_MODIFY = 0x002
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+# struct inotify_event: wd, mask, cookie, len (followed by the name)
+EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """ Minimal inotify binding through ctypes. Directories are watched instead of the files, so that
+        files replaced by a new one (as editors and plotting libraries do when saving) are still seen.
+    """
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._add_watch = libc.inotify_add_watch
+        self.fd = libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        # {watch descriptor: directory}
+        self.watches = {}
+
+    def add(self, directory):
+        if directory in self.watches.values():
+            return
+        name = directory if isinstance(directory, bytes) else directory.encode(sys.getfilesystemencoding())
+        wd = self._add_watch(self.fd, name, IN_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), "%s: %s" % (directory, os.strerror(ctypes.get_errno())))
+        self.watches[wd] = directory
+
+    def read(self, timeout):
+        """ Waits up to timeout seconds for events.
+            :return: list of the paths that changed in the watched directories.
+        """
+        try:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+        except select.error as e:
+            if e.args[0] == errno.EINTR:
+                return []
+            raise
+        if not ready:
+            return []
+        data = os.read(self.fd, 65536)
+        paths = []
+        offset = 0
+        while offset + EVENT.size <= len(data):
+            wd, mask, cookie, length = EVENT.unpack_from(data, offset)
+            name = data[offset + EVENT.size:offset + EVENT.size + length].rstrip(b'\0')
+            offset += EVENT.size + length
+            if wd in self.watches and name:
+                if not isinstance(name, str):
+                    name = name.decode(sys.getfilesystemencoding())
+                paths.append(os.path.join(self.watches[wd], name))
+        return paths
+
+    def close(self):
+        os.close(self.fd)
+
+
+class FileWatcher:
+    def __init__(self, paths, callback, debounce=0.5, interval=1.0, polling=False):
+        """ Calls callback(paths) from a thread of its own with the watched files whose content changed.
+            Bursts of writes are reported once, when the files have not been touched for debounce
+            seconds, and files whose content is the same as before (or that are missing) are not reported.
+            :param paths: files to watch.
+            :param interval: seconds between checks, when polling.
+            :param polling: poll the files even when inotify is available.
+        """
+        self.logger = logging.getLogger('filewatch.FileWatcher')
+        self.callback = callback
+        self.debounce = debounce
+        self.interval = interval
+        self.inotify = None
+        if not polling:
+            try:
+                self.inotify = Inotify()
+            except (OSError, AttributeError) as e:
+                self.logger.warning("inotify is not available (%s), polling every %.1f s." % (e, interval))
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.thread = None
+        self.paths = set()
+        # Content hash of every file when it was last reported (or synced), and its stat when polling
+        self.known = {}
+        self.stats = {}
+        self.set_paths(paths)
+
+    def set_paths(self, paths):
+        """ Watches paths instead of the current files. Their current content is the reference."""
+        with self._lock:
+            self.paths = set(os.path.abspath(path) for path in paths if path)
+            self.known = dict((path, self.content_hash(path)) for path in self.paths)
+            self.stats = dict((path, self.stat(path)) for path in self.paths)
+            if self.inotify is not None:
+                for directory in set(os.path.dirname(path) for path in self.paths):
+                    try:
+                        self.inotify.add(directory)
+                    except OSError as e:
+                        self.logger.warning("Cannot watch %s" % e)
+        self.logger.debug("Watching %s" % ", ".join(sorted(self.paths)))
+
+    def sync(self, paths):
+        """ Takes the current content of paths as the reference, so that the files written by the
+            program itself are not reported as changes.
+        """
+        with self._lock:
+            for path in paths:
+                path = os.path.abspath(path)
+                if path in self.paths:
+                    self.known[path] = self.content_hash(path)
+
+    @staticmethod
+    def content_hash(path):
+        try:
+            h = hashlib.sha1()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    h.update(chunk)
+            return h.hexdigest()
+        except (IOError, OSError):
+            return None
+
+    @staticmethod
+    def stat(path):
+        try:
+            st = os.stat(path)
+            return st.st_mtime, st.st_size, st.st_ino
+        except OSError:
+            return None
+
+    def touched(self, timeout):
+        """ Waits up to timeout seconds, and returns the watched files that were written meanwhile."""
+        if self.inotify is not None:
+            return [path for path in self.inotify.read(timeout) if path in self.paths]
+        self._stop.wait(timeout)
+        touched = []
+        with self._lock:
+            for path in self.paths:
+                stat = self.stat(path)
+                if stat != self.stats.get(path):
+                    self.stats[path] = stat
+                    touched.append(path)
+        return touched
+
+    def changed(self, paths):
+        """ Files among paths whose content differs from the reference, which becomes the new one."""
+        changed = []
+        with self._lock:
+            for path in paths:
+                digest = self.content_hash(path)
+                if digest is not None and digest != self.known.get(path):
+                    self.known[path] = digest
+                    changed.append(path)
+        return sorted(changed)
+
+    def run(self):
+        # Files written and when they were last touched
+        pending = {}
+        while not self._stop.is_set():
+            timeout = min(self.debounce, self.interval) if pending else self.interval
+            for path in self.touched(timeout):
+                pending[path] = time.time()
+            if pending and time.time() - max(pending.values()) >= self.debounce:
+                changed = self.changed(pending)
+                pending = {}
+                if changed:
+                    self.logger.debug("Changed: %s" % ", ".join(changed))
+                    try:
+                        self.callback(changed)
+                    except Exception as e:
+                        self.logger.error("Watch callback failed: %s" % e)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='filewatch')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.inotify is not None:
+            self.inotify.close()
+            self.inotify = None
+
+
+class Coalescer:
+    def __init__(self, job):
+        """ Runs job(paths) in a background thread for the changes passed to add(). Changes that arrive
+            while the job runs are merged, and handled by a single run when it finishes.
+        """
+        self.logger = logging.getLogger('filewatch.Coalescer')
+        self.job = job
+        self.pending = set()
+        self.stopped = False
+        self._cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='coalescer')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def add(self, paths):
+        with self._cond:
+            self.pending.update(paths)
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while not self.pending and not self.stopped:
+                    # With a timeout, so that the thread does not block signals in python 2
+                    self._cond.wait(0.5)
+                if self.stopped:
+                    return
+                paths = sorted(self.pending)
+                self.pending = set()
+            try:
+                self.job(paths)
+            except Exception as e:
+                self.logger.error("Update failed: %s" % e)
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            self._cond.notify()
+        self.thread.join()
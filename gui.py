@@ -17,261 +17,29 @@
 """
 
 import os
-import re
-import threading
+import copy
 import urllib
 # import gi
 # gi.require_version('Gtk', '3.10')
-from gi.repository import Gtk, GObject, Gdk
+from gi.repository import Gtk, GLib, Gdk, GdkPixbuf
+from core import Data, PSFrag
+from subsparser import new_label
+from jobqueue import Job, JobQueue
+from filewatch import FileWatcher
+from preview import Previewer, preview_key, PREVIEW_DENSITY
 
 import logging
 
 logging.getLogger('gui').addHandler(logging.NullHandler())
 TARGET_TYPE_URI_LIST = 0
-
-
-class Data:
-    def __init__(self, filepath="example.eps", subspath="subs.tex", cwd="./",
-                 pdf=False, svg=False, png=False, density=300):
-        self.logger = logging.getLogger('gui.Data')
-
-        self.subspath = subspath
-        # Files
-        self.subsfile = os.path.basename(subspath)
-        self.logger.debug('Subs file: %s' % self.subsfile)
-
-        # Files names (without extension)
-        self.subsname = self.subsfile[0:-4]
-        self.logger.debug('Subs file name: %s' % self.subsname)
-        self.ferror = 1
-
-        # Dirs
-        self.subsdir = os.path.dirname(subspath)
-        self.logger.debug('Subs directory: %s' % self.subsdir)
-        self.cwd = cwd
-        self.epscwd = cwd
-
-        # Output format options
-        self.eps = True
-        self.pdf = pdf
-        self.svg = svg
-        self.png = png
-        self.density = density  # Default density for png conversion
-
-        # List where the tags and substitutions are stored
-        self.labels = [{"label": "", "latex": ""}]
-        self.epsimage = 1
-
-        # Paths
-        if filepath is None:
-            self.epspath = None
-            self.epsfile = None
-            self.epsname = None
-            self.epsdir = None
-        else:
-            self.open_epsfile(filepath)
-
-        # Checking files
-        subs = self.check_file(self.subspath, False)
-        self.check_extension(self.subsfile, 'tex')
-
-        # Prepare the subs file to read (tags and replacements)
-        self.subspre = None
-        self.subsps = None
-        if subs:
-            f2 = open(self.subspath, 'r')
-            self.subs = f2.read()
-            self.logger.debug("Loading labels from %s ..." % self.subsfile)
-            self.tags, self.reps = self.read_subs()
-        else:
-            self.subspre = "% BEGIN INFO\n% END INFO\n"
-            self.tags = []
-            self.reps = []
-
-    def open_epsfile(self, filepath):
-        if filepath[0] == '~':
-            self.logger.debug(filepath)
-            self.epspath = os.path.expanduser(filepath)
-            self.logger.debug(self.epspath)
-        else:
-            self.epspath = filepath
-        self.logger.info("Loading %s ..." % self.epspath)
-        self.epsfile = os.path.basename(self.epspath)
-        self.logger.debug('Eps file: %s' % self.epsfile)
-        self.epsname = self.epsfile[0:-4]
-        self.logger.debug('Eps file name: %s' % self.epsname)
-        self.epsdir = os.path.dirname(self.epspath)
-        self.epscwd = self.epsdir
-        if self.epsdir == "":
-            self.epsdir = "./"
-        self.logger.debug('Eps directory: %s' % self.epsdir)
-        self.check_file(self.epspath)
-        self.ferror = self.check_extension(self.epsfile, 'eps')
-        # Prepare the eps file to read (tags)
-        f = open(self.epspath, 'r')
-        self.epsimage = f.read()
-
-    def check_file(self, fin, critical=True):
-        self.logger.debug("Checking %s file ..." % fin)
-        if not os.path.exists(fin):
-            if critical:
-                raise IOError('File %s/%s does not exist.' % (self.cwd, fin))
-            else:
-                self.logger.error('File %s/%s does not exist.' % (self.cwd, fin))
-                return False
-        else:
-            return True
-
-    def check_extension(self, fin, extension):
-        self.logger.debug("Checking %s extension ..." % fin)
-        if not fin.endswith(extension):
-            self.logger.error("File %s is not a %s file." % (fin, extension))
-            return 1
-        else:
-            return 0
-
-    def read_subs(self):
-        self.subspre = re.findall(r'% BEGIN INFO.*?% END INFO\n', self.subs, re.DOTALL)
-        self.subsps = re.findall(r'% BEGIN PS(.*?)% END PS\n', self.subs, re.DOTALL)
-        tags = []
-        reps = []
-        if self.subsps:
-            psfrags = re.findall(r'\n.*?%EndPs', self.subsps[0], re.DOTALL)
-        else:
-            self.logger.warning('I did not find any psfrag commands ...')
-            return tags, reps
-
-        plenght = len("\\psfrag{")
-        for k, psfrag in enumerate(psfrags):
-            if psfrag:
-                tag = re.findall(r'\\psfrag{(.*?)}', psfrag)
-                length = plenght + len(tag[0])
-                tags.append(tag[0])
-                rep = re.findall(r']{(.*?)} %EndPs', psfrag[length:])
-                if not rep:
-                    rep = re.findall(r']{(.*?)}%EndPs', psfrag[length:])[0]
-                else:
-                    rep = rep[0]
-                reps.append(rep)
-            else:
-                del psfrags[k]
-        self.logger.debug(tags)
-        self.logger.debug(reps)
-        return tags, reps
-
-
-class PSFrag:
-    def __init__(self, data=None):
-        self.logger = logging.getLogger('gui.PSFrag')
-        if data is None:
-            self.d = Data()
-        else:
-            self.d = data
-
-        # Basic configuration for LaTeX
-        self.preamble = "\\documentclass[a4paper]{article}\n" \
-                        "\\usepackage{graphicx, psfrag}\n" \
-                        "\\begin{document}\n" \
-                        "\\pagestyle{empty}\n" \
-                        "\\begin{figure}[htbp]\n"
-
-        self.graphic = "\\centerline{\\includegraphics[width=\\textwidth]{%s}}\n" % self.d.epspath
-        self.ending = "\\end{figure}\n" \
-                      "\\end{document}"
-
-        self.subsname = None
-
-    def check_tag(self, index):
-        tag = self.d.labels[index]['label']
-        self.logger.debug("Searching for %s ..." % tag)
-        # Find the tag in the eps file
-        tags = re.findall('\(' + tag + '\) show', self.d.epsimage, re.DOTALL)
-        self.logger.debug(tags)
-        if len(tags) == 0:
-            return False
-        else:
-            return True
-
-    def create_subs(self):
-        filename = "%s/subs-%s.tex" % (self.d.epsdir, self.d.epsname)
-        self.subsname = filename
-        self.logger.debug("Writing substitution file in %s ..." % filename)
-        f = open(filename, 'w')
-        if self.d.subspre:
-            f.write(self.d.subspre[0])
-        else:
-            f.write("% BEGIN INFO\n")
-            f.write("% END INFO\n")
-            self.logger.warning("Something is not going ok with %s ..." % filename)
-            self.logger.warning("There are no tags to replace ...")
-        f.write("% BEGIN PS\n")
-        for row in self.d.labels:
-            f.write("\\psfrag{" + row['label'] + "}[][]{" + row['latex'] + "} %EndPs\n")
-        f.write("% END PS\n")
-        f.close()
-        self.logger.debug("Writing Done!")
-
-    def do_replace(self):
-        # Create latex file
-        filedir = "%s" % self.d.epsdir
-        filename = "%s/%s" % (filedir, self.d.epsname)
-        latexname = "%s/%s.tex" % (filedir, self.d.epsname)
-        self.logger.debug("Writing latex file in %s ..." % latexname)
-        f = open(latexname, 'w')
-        f.write(self.preamble)
-        f.write("\\input{%s}\n" % self.subsname)
-        f.write("\\centerline{\\includegraphics[width=\\textwidth]{%s.eps}}\n" % filename)
-        f.write(self.ending)
-        f.close()
-        self.logger.debug("Writing Done!")
-
-        # Compile latex file
-        self.logger.debug("Compiling LaTeX ...")
-        os.popen('latex -output-directory=%s -shell-escape -interaction=nonstopmode -file-line-error  %s '
-                 '| grep ".*:[0-9]*:.*"' % (filedir, latexname))
-        # os.popen('latex %s' % latexname)
-        self.logger.debug("Done!")
-        self.logger.debug("Transforming dvi -> ps -> pdf -> pdf-crop -> ps-crop -> eps-crop ...")
-        os.popen('dvips -o %s.ps -q* %s.dvi' % (filename, filename))
-        os.popen('ps2pdf %s.ps %s.pdf' % (filename, filename))
-        os.popen('pdfcrop --noverbose %s.pdf | grep nothing' % filename)
-        os.popen('pdftops -q %s-crop.pdf' % filename)
-        os.popen('ps2eps -q %s-crop.ps' % filename)
-        self.logger.debug("Done!")
-
-        self.logger.debug("Removing auxiliary files ...")
-        os.popen('rm %s.dvi %s.pdf %s.ps %s-crop.ps' % (filename, filename, filename, filename))
-        os.popen('rm %s.aux %s.log' % (filename, filename))
-        self.logger.debug("Done!")
-
-        if self.d.svg:
-            self.logger.info("Creating SVG file ...")
-            os.popen('pdf2svg %s-crop.pdf %s-latex.svg' % (filename, filename))
-            self.logger.info("Done!")
-
-        if self.d.png:
-            self.logger.info("Creating png file, with density %d ..." % self.d.density)
-            os.popen('convert -density %d %s-crop.pdf %s-latex.png' % (self.d.density, filename, filename))
-            self.logger.info("Done!")
-
-        if self.d.pdf:
-            self.logger.info("Creating pdf file ...")
-            os.popen('mv %s-crop.pdf %s-latex.pdf' % (filename, filename))
-            self.logger.info("Done!")
-        else:
-            os.popen('rm %s-crop.pdf' % filename)
-
-        if self.d.eps:
-            os.popen('mv %s-crop.eps %s-latex.eps' % (filename, filename))
-            self.logger.info("New EPS file is %s-latex.eps." % filename)
-        else:
-            os.popen('rm %s-crop.eps' % filename)
-
-        self.logger.debug("All jobs finished.")
+# Columns of the table of replacements: tag, replacement and whether the tag is in the eps file (stock icon)
+COL_LABEL, COL_LATEX, COL_STATUS = range(3)
+# Time without edits (ms) before the preview is rendered
+PREVIEW_DELAY = 500
 
 
 class MainGui:
-    def __init__(self, data=None, psfrag=None):
+    def __init__(self, data=None, psfrag=None, library=None, watch=False, polling=False, project=None):
         if data is None:
             self.d = Data()
         else:
@@ -282,6 +50,10 @@ class MainGui:
         else:
             self.pf = psfrag
         self.logger = logging.getLogger('gui.MainGui')
+        # Substitution library (see library.SubsLibrary) used to suggest replacements, or None
+        self.library = library
+        # Project whose replacements are preferred (--project)
+        self.project = project
         scriptpath = os.path.realpath(__file__)
         scriptdir = os.path.dirname(scriptpath)
 
@@ -289,22 +61,30 @@ class MainGui:
         self.builder.add_from_file("%s/v0.312.glade" % scriptdir)
 
         self.window = self.builder.get_object("window1")
-        self.window.connect("delete-event", Gtk.main_quit)
+        self.window.connect("delete-event", self.on_exit_clicked)
 
         self.densityspin = self.builder.get_object("density")
-        self.densityspin.set_value(self.d.density)
+        self.densityspin.set_value(self.d.densities()[0])
         pdfbutton = self.builder.get_object("PDF")
         pdfbutton.set_active(self.d.pdf)
         svgbutton = self.builder.get_object("SVG")
         svgbutton.set_active(self.d.svg)
         pngbutton = self.builder.get_object("png")
         pngbutton.set_active(self.d.png)
-        self.listbox = self.builder.get_object("replacements")
         self.im_update = self.builder.get_object("image1")
         self.im_error = self.builder.get_object("image2")
         self.im_ok = self.builder.get_object("image3")
-        label = self.builder.get_object("entry2")
-        latex = self.builder.get_object("entry3")
+        # Texts found in the eps file, offered as completions of the label cells
+        self.tagstore = Gtk.ListStore(str)
+        self.update_tagstore()
+        # Table of replacements: row k of the store is self.d.labels[k]. The view shows it through a
+        # filter, and only draws the visible rows.
+        self.labelstore = Gtk.ListStore(str, str, str)
+        self.filtermodel = self.labelstore.filter_new()
+        self.filtermodel.set_visible_func(self.row_visible)
+        self.filterentry = self.builder.get_object("filter")
+        self.treeview = self.builder.get_object("replacements")
+        self.add_columns()
         self.openentry = self.builder.get_object("fileentry")
         if self.d.epspath is not None:
             self.openentry.set_text(self.d.epspath)
@@ -316,11 +96,11 @@ class MainGui:
                    "on_SVG_toggled": self.on_svg_toggled,
                    "on_png_toggled": self.on_png_toggled,
                    "on_density_value_changed": self.on_density_value_changed,
-                   "on_label_activate": self.on_label_activate,
-                   "on_latex_activate": self.on_latex_activate,
+                   "on_filter_changed": self.on_filter_changed,
                    "on_add_clicked": self.on_add_clicked,
-                   "on_check_clicked": self.on_check_clicked,
+                   "on_checkall_clicked": self.on_checkall_clicked,
                    "on_replace_clicked": self.on_replace_clicked,
+                   "on_cancel_clicked": self.on_cancel_clicked,
                    "on_open_clicked": self.on_open_clicked,
                    "on_fileentry_activate": self.on_fileentry_activate,
                    "on_fileentry_drag_data_received": self.on_drag_data}
@@ -333,21 +113,44 @@ class MainGui:
         self.builder.connect_signals(signals)
         self.pbar = self.builder.get_object("progressbar1")
         self.repbutton = self.builder.get_object("replace")
-        self.timeout_id = None
+        self.cancelbutton = self.builder.get_object("cancel")
+        # Conversions run one at a time in a worker thread, the widgets are only touched in the main loop
+        self.queue = JobQueue(GLib.idle_add)
+        self.queue.on_started = self.on_job_started
+        self.queue.on_progress = self.on_job_progress
+        self.queue.on_finished = self.on_job_finished
+        # Watch mode: the files that changed are parsed again in the main loop and rendered in the
+        # background. Changes that arrive during a render are rendered together when it finishes.
+        self.watcher = None
+        self.rerender = False
+        if watch:
+            self.watcher = FileWatcher(self.d.watched_paths(),
+                                       lambda paths: GLib.idle_add(self.on_files_changed, paths), polling=polling)
+            self.watcher.start()
+        # Preview of the replacements at screen resolution, rendered when the edits stop (see schedule_preview)
+        self.previewimage = self.builder.get_object("preview")
+        self.previewstatus = self.builder.get_object("previewstatus")
+        resolution = Gdk.Screen.get_default().get_resolution()
+        self.previewer = Previewer(lambda key, png, error: GLib.idle_add(self.on_preview_ready, key, png, error),
+                                   int(resolution) if resolution > 0 else PREVIEW_DENSITY)
+        self.preview_key = None
+        self.preview_timer = None
 
         # We load the replacements from the subs file, if any:
         if self.d.tags:
             self.logger.debug("Setting default tags and replacements...")
-            for tag, rep in zip(self.d.tags, self.d.reps):
-                label.set_text(tag)
-                self.on_label_activate(label)
-                latex.set_text(rep)
-                self.on_latex_activate(latex)
-                if len(self.d.labels) < len(self.d.tags):
-                    label, latex = self.on_add_clicked(None)
-
-    def on_exit_clicked(self, event):
+            self.d.add_labels(self.d.entries)
+        self.load_rows()
+        if self.d.epspath is not None:
+            self.suggest_rows()
+        self.schedule_preview()
+
+    def on_exit_clicked(self, event, *args):
         self.logger.debug('Button %s pressed' % event)
+        self.queue.cancel_all()
+        if self.watcher is not None:
+            self.watcher.stop()
+        self.previewer.stop()
         Gtk.main_quit()
 
     def on_open_clicked(self, event):
@@ -362,6 +165,11 @@ class MainGui:
             self.logger.debug("File selected: " + dialog.get_filename())
             self.d.open_epsfile(dialog.get_filename())
             self.openentry.set_text(self.d.epspath)
+            self.watch_files()
+            self.update_tagstore()
+            self.update_status()
+            self.suggest_rows()
+            self.schedule_preview()
         elif response == Gtk.ResponseType.CANCEL:
             self.logger.debug("Cancel clicked")
 
@@ -371,6 +179,11 @@ class MainGui:
         self.logger.debug('Text on %s modified' % event)
         filename = event.get_text()
         self.d.open_epsfile(filename)
+        self.watch_files()
+        self.update_tagstore()
+        self.update_status()
+        self.suggest_rows()
+        self.schedule_preview()
 
     def on_drag_data(self, event, context, x, y, selection, target_type, timestamp):
         self.logger.debug('Something dropped on %s' % event)
@@ -384,6 +197,170 @@ class MainGui:
                 if os.path.isfile(path):  # is it file?
                     self.logger.debug("Dropped file name: %s" % path)
                     self.d.open_epsfile(path)
+                    self.watch_files()
+                    self.update_tagstore()
+                    self.update_status()
+                    self.suggest_rows()
+                    self.schedule_preview()
+
+    def watch_files(self):
+        """ Watches the files of the eps file that was just opened, in watch mode."""
+        if self.watcher is not None:
+            self.watcher.set_paths(self.d.watched_paths())
+
+    def on_files_changed(self, paths):
+        self.logger.info("Changed: %s" % ", ".join(os.path.basename(path) for path in paths))
+        reloaded = self.d.reload(paths)
+        if 'eps' in reloaded:
+            self.update_tagstore()
+        if 'subs' in reloaded:
+            self.load_rows()
+        else:
+            self.update_status()
+        self.schedule_preview()
+        if self.queue.busy():
+            self.rerender = True
+        else:
+            self.render_changes()
+        return False
+
+    def render_changes(self):
+        psfrag = self.snapshot()
+        try:
+            psfrag.validate()
+        except ValueError as e:
+            self.logger.error("Not rendering the changes: %s." % e)
+            return
+        self.submit(psfrag)
+
+    def schedule_preview(self, edit=None):
+        """ Shows the preview of the replacements: at once if its thumbnail is in memory, otherwise it is
+            rendered when there are no edits for PREVIEW_DELAY ms, so typing does not start a compilation
+            for every key.
+            :param edit: text being typed in a cell, (row index, 'label' or 'latex', text).
+        """
+        if self.preview_timer is not None:
+            GLib.source_remove(self.preview_timer)
+            self.preview_timer = None
+        if not self.d.epspath:
+            return
+        psfrag = self.snapshot()
+        if edit is not None:
+            index, column, text = edit
+            psfrag.d.labels[index][column] = text
+        try:
+            key = preview_key(psfrag)
+        except OSError as e:
+            self.previewstatus.set_text("%s" % e)
+            return
+        self.preview_key = key
+        png = self.previewer.thumbnails.get(key)
+        if png is not None:
+            self.show_preview(png)
+        else:
+            self.preview_timer = GLib.timeout_add(PREVIEW_DELAY, self.start_preview, key, psfrag)
+
+    def start_preview(self, key, psfrag):
+        self.preview_timer = None
+        self.previewstatus.set_text("Rendering preview ...")
+        self.previewer.request(key, psfrag)
+        return False
+
+    def on_preview_ready(self, key, png, error):
+        # Previews of outdated replacements are only kept in memory
+        if key == self.preview_key:
+            if png is None:
+                self.previewstatus.set_text(error)
+            else:
+                self.show_preview(png)
+        return False
+
+    def show_preview(self, png):
+        """ Shows the png contents in the preview pane, scaled down to its width."""
+        loader = GdkPixbuf.PixbufLoader.new_with_type('png')
+        loader.write(png)
+        loader.close()
+        pixbuf = loader.get_pixbuf()
+        width = self.previewimage.get_parent().get_allocated_width()
+        if 0 < width < pixbuf.get_width():
+            height = max(1, pixbuf.get_height() * width // pixbuf.get_width())
+            pixbuf = pixbuf.scale_simple(width, height, GdkPixbuf.InterpType.BILINEAR)
+        self.previewimage.set_from_pixbuf(pixbuf)
+        self.previewstatus.set_text("")
+
+    def on_cell_changed(self, editable, path, column):
+        self.schedule_preview((self.row_index(path), column, editable.get_text()))
+
+    def add_columns(self):
+        for title, column, callback in (("EPS label", COL_LABEL, self.on_label_edited),
+                                        ("Replacement text", COL_LATEX, self.on_latex_edited)):
+            renderer = Gtk.CellRendererText(editable=True)
+            renderer.connect("edited", callback)
+            if column == COL_LABEL:
+                renderer.connect("editing-started", self.on_label_editing_started)
+            else:
+                renderer.connect("editing-started", self.on_latex_editing_started)
+            treecolumn = Gtk.TreeViewColumn(title, renderer, text=column)
+            # Fixed sizes, so that the view does not measure every row
+            treecolumn.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+            treecolumn.set_fixed_width(220)
+            treecolumn.set_resizable(True)
+            treecolumn.set_expand(True)
+            self.treeview.append_column(treecolumn)
+        renderer = Gtk.CellRendererPixbuf()
+        treecolumn = Gtk.TreeViewColumn("", renderer)
+        treecolumn.add_attribute(renderer, "stock-id", COL_STATUS)
+        treecolumn.set_sizing(Gtk.TreeViewColumnSizing.FIXED)
+        treecolumn.set_fixed_width(32)
+        self.treeview.append_column(treecolumn)
+
+    def load_rows(self):
+        """ Fills the table with self.d.labels. The view is detached meanwhile, so it is not updated
+            for every row.
+        """
+        self.treeview.set_model(None)
+        self.labelstore.clear()
+        for row in self.d.labels:
+            self.labelstore.append([row['label'], row['latex'], self.row_status(row['label'])])
+        self.treeview.set_model(self.filtermodel)
+
+    def row_status(self, tag):
+        if not tag or not self.d.epspath:
+            return None
+        return "gtk-apply" if tag in self.d.epstags else "gtk-dialog-error"
+
+    def update_status(self):
+        for row in self.labelstore:
+            row[COL_STATUS] = self.row_status(row[COL_LABEL])
+
+    def row_visible(self, model, treeiter, data):
+        text = self.filterentry.get_text().lower()
+        if not text:
+            return True
+        return any(text in (model[treeiter][column] or '').lower() for column in (COL_LABEL, COL_LATEX))
+
+    def row_index(self, path):
+        """ Index in self.d.labels of the row at path of the view."""
+        return self.filtermodel.convert_path_to_child_path(Gtk.TreePath.new_from_string(path)).get_indices()[0]
+
+    def suggest_rows(self):
+        """ Adds the replacements that the library has for the texts of the eps file not in the table."""
+        if self.library is None:
+            return
+        if self.d.suggest_labels(self.library, self.project):
+            self.load_rows()
+
+    def set_completion(self, entry):
+        completion = Gtk.EntryCompletion()
+        completion.set_model(self.tagstore)
+        completion.set_text_column(0)
+        entry.set_completion(completion)
+
+    def update_tagstore(self):
+        """ Fills the completion model with the texts indexed in the loaded eps file."""
+        self.tagstore.clear()
+        for tag in sorted(self.d.epstags):
+            self.tagstore.append([tag])
 
     @staticmethod
     def get_file_path_from_dnd_dropped_uri(uri):
@@ -425,83 +402,86 @@ class MainGui:
         self.d.density = self.densityspin.get_value()
         self.logger.debug('Density for PNG conversion: %d' % self.d.density)
 
-    def on_label_activate(self, event):
-        self.logger.debug('Text on %s modified' % event)
-        box = event.get_parent()
-        listboxrow = box.get_parent()
-
-        rowindex = listboxrow.get_index()
-        self.listbox.select_row(listboxrow)
-        tag = "label"
-        self.d.labels[rowindex][tag] = event.get_text()
-        self.logger.debug('Text at %s: %s' % (tag, self.d.labels[rowindex][tag]))
-
-    def on_latex_activate(self, event):
+    def on_filter_changed(self, event):
         self.logger.debug('Text on %s modified' % event)
-        box = event.get_parent()
-        listboxrow = box.get_parent()
-
-        rowindex = listboxrow.get_index()
-        self.listbox.select_row(listboxrow)
-        tag = "latex"
-        self.d.labels[rowindex][tag] = event.get_text()
-        self.logger.debug('Text at %s: %s' % (tag, self.d.labels[rowindex][tag]))
+        self.filtermodel.refilter()
+
+    def on_label_editing_started(self, renderer, editable, path):
+        self.set_completion(editable)
+        editable.connect("changed", self.on_cell_changed, path, 'label')
+
+    def on_latex_editing_started(self, renderer, editable, path):
+        editable.connect("changed", self.on_cell_changed, path, 'latex')
+
+    def on_label_edited(self, renderer, path, text):
+        rowindex = self.row_index(path)
+        self.d.labels[rowindex]['label'] = text
+        self.labelstore[rowindex][COL_LABEL] = text
+        self.labelstore[rowindex][COL_STATUS] = self.row_status(text)
+        self.logger.debug('Text at label: %s' % text)
+        if text and self.d.epspath and text not in self.d.epstags:
+            self.logger.warning("Tag %s not found." % text)
+        self.schedule_preview()
+
+    def on_latex_edited(self, renderer, path, text):
+        rowindex = self.row_index(path)
+        self.d.labels[rowindex]['latex'] = text
+        self.labelstore[rowindex][COL_LATEX] = text
+        self.logger.debug('Text at latex: %s' % text)
+        self.schedule_preview()
 
     def on_add_clicked(self, event):
         self.logger.debug('Button %s pressed' % event)
-        newbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL)
-        self.listbox.insert(newbox, -1)
-        label_entry = Gtk.Entry()
-        label_entry.connect("activate", self.on_label_activate)
-        latex_entry = Gtk.Entry()
-        latex_entry.connect("activate", self.on_latex_activate)
-        button = Gtk.Button(label="Check", image=Gtk.Image(stock="gtk-refresh"))
-        button.connect("clicked", self.on_check_clicked)
-
-        newbox.pack_start(label_entry, True, True, padding=4)
-        newbox.pack_start(latex_entry, True, True, padding=4)
-        newbox.pack_start(button, True, True, padding=4)
-        self.d.labels.append({"label": "", "latex": ""})
-
-        self.window.show_all()
-        return label_entry, latex_entry
-
-    def on_check_clicked(self, event):
+        self.d.labels.append(new_label())
+        treeiter = self.labelstore.append(['', '', None])
+        # Show the new row and start editing its label
+        self.filterentry.set_text('')
+        self.filtermodel.refilter()
+        path = self.filtermodel.convert_child_path_to_path(self.labelstore.get_path(treeiter))
+        self.treeview.set_cursor(path, self.treeview.get_column(COL_LABEL), True)
+
+    def on_checkall_clicked(self, event):
+        """ Checks every row against the texts of the eps file at once and shows what is missing."""
         self.logger.debug('Button %s pressed' % event)
-        box = event.get_parent()
-        children = box.get_children()
-        entry1 = children[0]
-        entry2 = children[1]
-        self.on_label_activate(entry1)
-        self.on_latex_activate(entry2)
-        listboxrow = box.get_parent()
-        rowindex = listboxrow.get_index()
-        self.listbox.select_row(listboxrow)
-        # Run a function of rowindex
-        if self.d.epspath:
-            exists = self.pf.check_tag(rowindex)
-            if exists:
-                self.logger.info("Tag %s found." % self.d.labels[rowindex]['label'])
-                event.set_image(Gtk.Image(stock="gtk-apply"))
-            else:
-                self.logger.warning("Tag %s not found." % self.d.labels[rowindex]['label'])
-                event.set_image(Gtk.Image(stock="gtk-dialog-error"))
-        else:
-            exists = False
+        if not self.d.epspath:
             self.logger.warning("There is no EPS file loaded.")
-            event.set_image(Gtk.Image(stock="gtk-dialog-error"))
             dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL,
                                        "Load an EPS file first.")
             dialog.run()
             dialog.destroy()
+            return
+        missing, unused = self.pf.check_labels()
+        self.update_status()
+        found = len(set(row['label'] for row in self.d.labels if row['label'])) - len(missing)
+        text = "%d tags found, %d missing." % (found, len(missing))
+        if missing:
+            text += "\n\nNot in the EPS file: %s" % self.short_list(missing)
+        if unused:
+            text += "\n\nTexts without replacement: %s" % self.short_list(unused)
+        dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.WARNING if missing else Gtk.MessageType.INFO,
+                                   Gtk.ButtonsType.OK, text)
+        dialog.run()
+        dialog.destroy()
+
+    @staticmethod
+    def short_list(names, limit=20):
+        if len(names) > limit:
+            return "%s ... (%d more)" % (", ".join(names[:limit]), len(names) - limit)
+        return ", ".join(names)
 
     def on_replace_clicked(self, event):
         self.logger.debug('Button %s pressed' % event)
         if self.d.epspath:
-            self.repbutton.set_image(Gtk.Image(stock='gtk-dialog-warning'))
-            self.timeout_id = GObject.timeout_add(50, self.on_timeout, True)
-            thread = threading.Thread(target=self.outside_task)
-            thread.start()
+            psfrag = self.snapshot()
+            try:
+                psfrag.validate()
+            except ValueError as e:
+                dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL,
+                                           "Nothing to compile: %s." % e)
+                dialog.run()
+                dialog.destroy()
+                return
+            self.submit(psfrag)
         else:
             self.logger.warning("There is no EPS file loaded.")
             dialog = Gtk.MessageDialog(self.window, 0, Gtk.MessageType.ERROR, Gtk.ButtonsType.CANCEL,
@@ -509,17 +489,60 @@ class MainGui:
             dialog.run()
             dialog.destroy()
 
-    def on_timeout(self, user_data):
-        self.pbar.pulse()
-        return user_data
-
-    def outside_task(self):
-        self.pf.create_subs()
-        self.pf.do_replace()
-        self.logger.info("Replacement done.")
-        self.repbutton.set_image(Gtk.Image(stock='gtk-apply'))
-        GObject.source_remove(self.timeout_id)
-        self.pbar.set_fraction(0.0)
+    def submit(self, psfrag):
+        if self.queue.submit(Job(psfrag)):
+            self.repbutton.set_image(Gtk.Image(stock='gtk-dialog-warning'))
+            self.cancelbutton.set_sensitive(True)
+            self.update_progress()
+
+    def on_cancel_clicked(self, event):
+        self.logger.debug('Button %s pressed' % event)
+        self.queue.cancel()
+
+    def snapshot(self):
+        """ Copy of the PSFrag object and its data for a job, so that the table can be edited while
+            the job runs.
+        """
+        data = copy.copy(self.d)
+        data.labels = [dict(row) for row in self.d.labels]
+        psfrag = copy.copy(self.pf)
+        psfrag.d = data
+        psfrag.pipeline = None
+        psfrag.workdir = None
+        psfrag.cancelled = False
+        return psfrag
+
+    def update_progress(self, fraction=0.0, text=""):
+        queued = self.queue.queued()
+        if queued:
+            text = "%s (%d queued)" % (text, queued) if text else "%d queued" % queued
+        self.pbar.set_fraction(fraction)
+        self.pbar.set_text(text)
+
+    def on_job_started(self, job):
+        self.update_progress(0.0, "Starting %s ..." % os.path.basename(job.name))
+
+    def on_job_progress(self, job, fraction, text):
+        self.update_progress(fraction, text)
+
+    def on_job_finished(self, job):
+        if job.state == 'done':
+            self.logger.info("Replacement done.")
+            self.repbutton.set_image(Gtk.Image(stock='gtk-apply'))
+        elif job.state == 'cancelled':
+            self.logger.info("Replacement cancelled.")
+            self.repbutton.set_image(Gtk.Image(stock='gtk-cancel'))
+        else:
+            self.logger.error("Replacement failed.")
+            self.repbutton.set_image(Gtk.Image(stock='gtk-dialog-error'))
+        if self.queue.busy():
+            self.update_progress()
+        else:
+            self.cancelbutton.set_sensitive(False)
+            self.update_progress(1.0 if job.state == 'done' else 0.0, job.state.capitalize())
+            if self.rerender:
+                self.rerender = False
+                self.render_changes()
 
     @staticmethod
     def add_filters(dialog):
@@ -0,0 +1,156 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import threading
+import collections
+import logging
+
+from pipeline import PipelineError, PipelineCancelled
+
+logging.getLogger('jobqueue').addHandler(logging.NullHandler())
+
+""" Queue of conversion jobs run one after the other in a worker thread. The callbacks are handed to a
+    dispatch function (GLib.idle_add in the GUI) so that they run in the thread of the main loop.
+"""
+
+
+class Job:
+    def __init__(self, psfrag):
+        """ :param psfrag: PSFrag object with its own copy of the data, not shared with the GUI."""
+        self.psfrag = psfrag
+        self.name = psfrag.d.epspath
+        # queued, running, done, failed or cancelled
+        self.state = 'queued'
+        self.error = None
+        # Output files, when it is done (see PSFrag.collect)
+        self.outputs = {}
+        d = psfrag.d
+        # Jobs with the same key would write the same files with the same contents
+        self.key = json.dumps([d.epspath, d.density, psfrag.engine, psfrag.preamble, psfrag.output_suffixes(),
+                               [[row['label'], row['latex']] + [row.get(o, '') for o in sorted(row)]
+                                for row in d.labels]])
+
+
+class JobQueue:
+    def __init__(self, dispatch=None):
+        """ :param dispatch: function(callback, *args) that runs the callback in the main loop.
+                             By default the callbacks run in the worker thread.
+        """
+        self.logger = logging.getLogger('jobqueue.JobQueue')
+        self.dispatch = dispatch or (lambda callback, *args: callback(*args))
+        # Callbacks: on_started(job), on_progress(job, fraction, text), on_finished(job)
+        self.on_started = None
+        self.on_progress = None
+        self.on_finished = None
+        self.pending = collections.deque()
+        self.current = None
+        self._lock = threading.Condition()
+        self._thread = None
+
+    def submit(self, job):
+        """ Queues the job, unless an identical one is already queued or running.
+            :return: True if the job was queued.
+        """
+        with self._lock:
+            jobs = list(self.pending) + ([self.current] if self.current is not None else [])
+            if any(j.key == job.key and j.state in ('queued', 'running') for j in jobs):
+                self.logger.warning("The same job for %s is already in the queue." % job.name)
+                return False
+            self.pending.append(job)
+            self.logger.debug("%s queued (%d pending)." % (job.name, len(self.pending)))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.worker)
+                self._thread.daemon = True
+                self._thread.start()
+            self._lock.notify_all()
+        return True
+
+    def cancel(self, job=None):
+        """ Cancels the running job, or the given one (queued or running)."""
+        with self._lock:
+            if job is None:
+                job = self.current
+            if job is None:
+                return
+            if job in self.pending:
+                self.pending.remove(job)
+                job.state = 'cancelled'
+                self.emit(self.on_finished, job)
+                return
+        self.logger.info("Cancelling %s ..." % job.name)
+        job.psfrag.cancel()
+
+    def cancel_all(self):
+        with self._lock:
+            pending = list(self.pending)
+        for job in pending:
+            self.cancel(job)
+        self.cancel()
+
+    def busy(self):
+        with self._lock:
+            return self.current is not None or len(self.pending) > 0
+
+    def queued(self):
+        with self._lock:
+            return len(self.pending)
+
+    def emit(self, callback, *args):
+        if callback is not None:
+            self.dispatch(callback, *args)
+
+    def worker(self):
+        while True:
+            with self._lock:
+                while not self.pending:
+                    self._lock.wait()
+                job = self.pending.popleft()
+                job.state = 'running'
+                self.current = job
+            self.run(job)
+            with self._lock:
+                self.current = None
+            self.emit(self.on_finished, job)
+
+    def run(self, job):
+        psfrag = job.psfrag
+
+        def listener(pipeline, stage, event):
+            fraction, running = pipeline.progress()
+            self.emit(self.on_progress, job, fraction, ", ".join(running) or stage.name)
+
+        psfrag.listener = listener
+        self.emit(self.on_started, job)
+        try:
+            psfrag.create_subs()
+            psfrag.do_replace()
+            job.outputs = psfrag.collect()
+        except PipelineCancelled:
+            job.state = 'cancelled'
+        except PipelineError as e:
+            job.state = 'failed'
+            job.error = str(e)
+        except Exception as e:
+            self.logger.error("%s failed: %s" % (job.name, e))
+            job.state = 'failed'
+            job.error = str(e)
+        else:
+            job.state = 'done'
+        finally:
+            psfrag.cleanup()
@@ -0,0 +1,118 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import sqlite3
+import logging
+
+from subsparser import parse_subs, OPTIONS
+
+logging.getLogger('library').addHandler(logging.NullHandler())
+
+""" Substitution library: the entries of many substitution files, stored in a SQLite database and
+    indexed by tag and project, so the replacements of every label of a figure are found with a
+    single query.
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    project  TEXT NOT NULL,
+    label    TEXT NOT NULL,
+    latex    TEXT NOT NULL,
+    posn     TEXT NOT NULL DEFAULT '',
+    psposn   TEXT NOT NULL DEFAULT '',
+    scale    TEXT NOT NULL DEFAULT '',
+    rot      TEXT NOT NULL DEFAULT '',
+    source   TEXT,
+    imported REAL,
+    PRIMARY KEY (project, label)
+);
+CREATE INDEX IF NOT EXISTS entries_label ON entries (label, imported);
+"""
+
+
+def default_library():
+    base = os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share'))
+    return os.path.join(base, 'pypsfrag', 'library.sqlite')
+
+
+class SubsLibrary:
+    def __init__(self, dbpath=None):
+        self.logger = logging.getLogger('library.SubsLibrary')
+        if dbpath is None:
+            dbpath = default_library()
+        self.dbpath = dbpath
+        dbdir = os.path.dirname(os.path.abspath(dbpath))
+        if not os.path.isdir(dbdir):
+            os.makedirs(dbdir)
+        self.db = sqlite3.connect(dbpath)
+        # Return the texts as str, like the ones read from the substitution files
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def import_subs(self, subspath, project=None):
+        """ Imports every entry of a substitution file. Entries of the same project and tag are replaced.
+            :param project: name of the project, by default the directory of the substitution file.
+            :return: number of entries imported.
+        """
+        if project is None:
+            project = os.path.basename(os.path.dirname(os.path.abspath(subspath)))
+        f = open(subspath, 'r')
+        info, entries, errors = parse_subs(f.read())
+        f.close()
+        for number, message in errors:
+            self.logger.warning("%s:%d: %s" % (subspath, number, message))
+        now = time.time()
+        with self.db:
+            self.db.executemany("INSERT OR REPLACE INTO entries (project, label, latex, posn, psposn, scale, rot, "
+                                "source, imported) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                                [(project, e['label'], e['latex'], e['posn'], e['psposn'], e['scale'], e['rot'],
+                                  os.path.abspath(subspath), now) for e in entries])
+        self.logger.info("Imported %d entries of %s into project %s." % (len(entries), subspath, project))
+        return len(entries)
+
+    def suggest(self, labels, project=None):
+        """ Looks up all the labels at once. When a tag is in several projects, the entry of the given
+            project is preferred, then the most recently imported one.
+            :return: dictionary {label: entry}, only with the labels found.
+        """
+        labels = list(set(labels))
+        if not labels:
+            return {}
+        cursor = self.db.cursor()
+        cursor.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (label TEXT PRIMARY KEY)")
+        cursor.execute("DELETE FROM wanted")
+        cursor.executemany("INSERT INTO wanted (label) VALUES (?)", [(label,) for label in labels])
+        rows = cursor.execute("SELECT e.label, e.latex, e.posn, e.psposn, e.scale, e.rot, e.project "
+                              "FROM wanted w JOIN entries e ON e.label = w.label "
+                              "ORDER BY e.label, e.project = ? DESC, e.imported DESC", (project or '',))
+        suggestions = {}
+        for row in rows:
+            if row[0] not in suggestions:
+                entry = dict(zip(('label', 'latex') + OPTIONS, row[:6]))
+                entry['project'] = row[6]
+                suggestions[row[0]] = entry
+        self.db.rollback()
+        return suggestions
+
+    def projects(self):
+        return [row[0] for row in self.db.execute("SELECT DISTINCT project FROM entries ORDER BY project")]
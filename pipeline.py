@@ -0,0 +1,324 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import time
+import signal
+import hashlib
+import subprocess
+import threading
+import logging
+
+logging.getLogger('pipeline').addHandler(logging.NullHandler())
+
+""" Stage graph executor: every stage is a subprocess (or a python callable) that starts as soon as
+    the stages it depends on have finished. Independent branches run at the same time, and the first
+    failure stops the whole job. Like make, stages whose command and inputs have not changed since a
+    previous run (and whose outputs are still there) can be skipped, see Pipeline.plan.
+"""
+
+
+class PipelineError(Exception):
+    def __init__(self, stage, message, output=""):
+        Exception.__init__(self, "Stage '%s' failed: %s" % (stage, message))
+        self.stage = stage
+        self.output = output
+
+
+class PipelineCancelled(PipelineError):
+    def __init__(self, stage=None):
+        Exception.__init__(self, "Job cancelled")
+        self.stage = stage
+        self.output = ""
+
+
+class Stage:
+    def __init__(self, name, cmd, deps=(), cwd=None, outputs=(), watch=None, env=None, inputs=()):
+        """ :param name: unique name of the stage.
+            :param cmd: list of arguments of the command, or a callable without arguments.
+            :param deps: names of the stages that must finish before this one starts.
+            :param cwd: working directory of the command.
+            :param outputs: files created by the stage, only used to report their size.
+            :param watch: callable that gets every line of the output of the command as soon as it is
+                          written. When it returns a message, the command is killed and the stage fails
+                          with that error.
+            :param env: environment of the command (the current one by default).
+            :param inputs: files read by the stage that are not outputs of other stages; their content
+                           is part of its fingerprint.
+        """
+        self.name = name
+        self.cmd = cmd
+        self.deps = list(deps)
+        self.cwd = cwd
+        self.outputs = list(outputs)
+        self.watch = watch
+        self.env = env
+        self.inputs = list(inputs)
+        # Hash of the command, the inputs and the fingerprints of the dependencies (see Pipeline.plan),
+        # and whether the outputs of a previous run can be used instead of running the stage
+        self.fingerprint = None
+        self.uptodate = False
+        self.returncode = None
+        self.output = ""
+        self.error = None
+        self.proc = None
+        # Measures: wall time, cpu time of the command (user + system) and size of the outputs
+        self.wall = None
+        self.cpu = None
+        self.size = None
+
+    def run(self):
+        """ Runs the stage, waiting for the command to finish. Sets self.error if it failed."""
+        t0 = time.time()
+        try:
+            if callable(self.cmd):
+                self.run_callable()
+            else:
+                self.run_command()
+        finally:
+            self.wall = time.time() - t0
+            self.size = sum(os.path.getsize(f) for f in self.outputs if os.path.exists(f))
+
+    def run_callable(self):
+        try:
+            self.cmd()
+            self.returncode = 0
+        except Exception as e:
+            self.returncode = -1
+            self.error = str(e)
+
+    def run_command(self):
+        try:
+            # In its own process group, so that kill() also reaches the commands it starts
+            self.proc = subprocess.Popen(self.cmd, cwd=self.cwd, stdout=subprocess.PIPE,
+                                         stderr=subprocess.STDOUT, universal_newlines=True,
+                                         preexec_fn=os.setpgrp, env=self.env)
+        except OSError as e:
+            self.returncode = -1
+            self.error = "could not run %s (%s)" % (self.cmd[0], e)
+            return
+        if self.watch is None:
+            self.output = self.proc.stdout.read()
+        else:
+            self.output = self.read_watched()
+        self.proc.stdout.close()
+        # Reap the process ourselves to get its resource usage
+        pid, status, rusage = os.wait4(self.proc.pid, 0)
+        self.cpu = rusage.ru_utime + rusage.ru_stime
+        if os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+        self.proc.returncode = self.returncode
+        if self.returncode != 0 and self.error is None:
+            self.error = "%s exited with status %d" % (self.cmd[0], self.returncode)
+
+    def read_watched(self):
+        """ Reads the output line by line, handing every line to self.watch, and kills the command
+            as soon as it reports an error.
+        """
+        lines = []
+        for line in iter(self.proc.stdout.readline, ''):
+            lines.append(line)
+            if self.error is not None:
+                continue
+            message = self.watch(line)
+            if message:
+                self.error = message
+                try:
+                    os.killpg(self.proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+        return "".join(lines)
+
+    def report(self):
+        if self.uptodate:
+            status = 'up-to-date'
+        elif self.returncode is None:
+            status = 'skipped'
+        else:
+            status = 'ok' if self.error is None else 'failed'
+        return {'stage': self.name,
+                'command': self.cmd if not callable(self.cmd) else None,
+                'status': status,
+                'exit_code': self.returncode,
+                'wall_time': self.wall,
+                'cpu_time': self.cpu,
+                'output_size': self.size}
+
+
+class Pipeline:
+    def __init__(self, name="job"):
+        self.logger = logging.getLogger('pipeline.Pipeline')
+        self.name = name
+        self.stages = []
+        self.failed = None
+        self.cancelled = False
+        self.wall = None
+        # Called as listener(pipeline, stage, event) when a stage 'start's and 'finish'es, from the
+        # thread of the stage
+        self.listener = None
+        self._done = set()
+        self._running = set()
+        self._lock = threading.Condition()
+
+    def add(self, name, cmd, deps=(), cwd=None, outputs=(), watch=None, env=None, inputs=()):
+        if name in [s.name for s in self.stages]:
+            raise ValueError("Stage %s already exists." % name)
+        for dep in deps:
+            if dep not in [s.name for s in self.stages]:
+                raise ValueError("Stage %s depends on unknown stage %s." % (name, dep))
+        stage = Stage(name, cmd, deps, cwd, outputs, watch, env, inputs)
+        self.stages.append(stage)
+        return stage
+
+    def stage(self, name):
+        for s in self.stages:
+            if s.name == name:
+                return s
+        raise KeyError(name)
+
+    def _run_stage(self, stage):
+        self.logger.debug("[%s] Starting %s ..." % (self.name, stage.name))
+        self.notify(stage, 'start')
+        stage.run()
+        with self._lock:
+            if stage.error is not None and self.failed is None:
+                self.failed = stage
+                self.kill()
+            self._done.add(stage.name)
+            self._running.discard(stage.name)
+            self._lock.notify_all()
+        self.logger.debug("[%s] %s finished with status %s." % (self.name, stage.name, stage.returncode))
+        self.notify(stage, 'finish')
+
+    def notify(self, stage, event):
+        if self.listener is not None:
+            try:
+                self.listener(self, stage, event)
+            except Exception as e:
+                self.logger.error("Pipeline listener failed: %s" % e)
+
+    def progress(self):
+        """ :return: fraction of finished stages and names of the running ones."""
+        with self._lock:
+            running = [s.name for s in self.stages if s.name in self._running]
+            return float(len(self._done)) / (len(self.stages) or 1), running
+
+    def report(self, stages=None):
+        """ Measures of every stage (or of the given stage names) as a list of dictionaries."""
+        return [s.report() for s in self.stages if stages is None or s.name in stages]
+
+    def kill(self):
+        """ Kills the commands that are still running."""
+        for stage in self.stages:
+            # Not proc.poll(): the stage thread reaps its process with os.wait4
+            if stage.proc is not None and stage.returncode is None:
+                try:
+                    os.killpg(stage.proc.pid, signal.SIGKILL)
+                except OSError:
+                    pass
+
+    def plan(self, previous=None):
+        """ Computes the fingerprint of every stage: a hash of its command (or its name and outputs, and
+            the arguments of functools.partial, for callables), the content of its inputs and the
+            fingerprints of its dependencies. A stage is up to date, and will not run, when its
+            fingerprint is the one of a previous run and all its outputs exist. Stages depending on a
+            stage that runs have a different fingerprint anyway.
+            :param previous: {stage name: fingerprint} of the successful stages of a previous run.
+            :return: number of stages that will run.
+        """
+        previous = previous or {}
+        fingerprints = {}
+        for stage in self.stages:
+            h = hashlib.sha1()
+            if callable(stage.cmd):
+                ident = [stage.name] + stage.outputs + list(getattr(stage.cmd, 'args', ()))
+            else:
+                ident = stage.cmd
+            items = [repr(ident), repr(stage.cwd)] + [fingerprints[dep] for dep in stage.deps]
+            for item in items:
+                h.update(('%d:%s' % (len(item), item)).encode('utf-8'))
+            for path in stage.inputs:
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(1 << 20), b''):
+                        h.update(chunk)
+            stage.fingerprint = fingerprints[stage.name] = h.hexdigest()
+            stage.uptodate = (previous.get(stage.name) == stage.fingerprint and
+                              all(os.path.exists(f) for f in stage.outputs))
+        torun = [s.name for s in self.stages if not s.uptodate]
+        self.logger.debug("[%s] Stages to run: %s" % (self.name, ", ".join(torun) or "none"))
+        return len(torun)
+
+    def fingerprints(self):
+        """ Fingerprints of the stages that succeeded or were up to date, for the next plan()."""
+        return dict((s.name, s.fingerprint) for s in self.stages
+                    if s.fingerprint is not None and (s.uptodate or (s.returncode == 0 and s.error is None)))
+
+    def cancel(self):
+        """ Stops the job from any thread: no more stages are started and the running ones are killed.
+            run() raises PipelineCancelled. It may be called before run().
+        """
+        with self._lock:
+            self.cancelled = True
+            self.kill()
+            self._lock.notify_all()
+
+    def run(self):
+        """ Runs every stage respecting its dependencies. Raises PipelineError on the first failure, or
+            PipelineCancelled if the job was cancelled.
+        """
+        self._done = set(s.name for s in self.stages if s.uptodate)
+        self._running = set()
+        self.failed = None
+        t0 = time.time()
+        threads = []
+        try:
+            self.schedule(threads)
+        except KeyboardInterrupt:
+            # The commands run in their own process groups, they do not get the signal
+            self.kill()
+            raise
+        for thread in threads:
+            thread.join()
+        self.wall = time.time() - t0
+        if self.cancelled:
+            raise PipelineCancelled(self.failed.name if self.failed is not None else None)
+        if self.failed is not None:
+            raise PipelineError(self.failed.name, self.failed.error, self.failed.output)
+
+    def schedule(self, threads):
+        """ Starts every stage as soon as its dependencies are done, until all of them have finished."""
+        pending = [s for s in self.stages if not s.uptodate]
+        with self._lock:
+            while pending or self._running:
+                if self.failed is None and not self.cancelled:
+                    for stage in list(pending):
+                        if all(dep in self._done for dep in stage.deps):
+                            pending.remove(stage)
+                            self._running.add(stage.name)
+                            thread = threading.Thread(target=self._run_stage, args=(stage,))
+                            thread.daemon = True
+                            threads.append(thread)
+                            thread.start()
+                else:
+                    # Stop scheduling, just wait for the running stages
+                    pending = []
+                if self._running:
+                    # With a timeout, so that the main thread still gets KeyboardInterrupt
+                    self._lock.wait(0.5)
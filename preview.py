@@ -0,0 +1,149 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from cache import RenderCache
+from pipeline import PipelineError, PipelineCancelled
+from subsparser import format_entry
+from texlog import format_diagnostic
+
+import logging
+
+logging.getLogger('preview').addHandler(logging.NullHandler())
+
+""" Previews of the replacements: the figure is rendered as a png at screen resolution in a thread of
+    its own, and the thumbnails are kept in memory by the hash of the substitution set.
+"""
+
+# Density of the previews when the resolution of the screen is unknown
+PREVIEW_DENSITY = 96
+
+
+def preview_key(psfrag):
+    """ Hash of what the preview of psfrag depends on: the eps file (path, size and modification
+        time, so that it is not read), the substitution set and the LaTeX document.
+    """
+    st = os.stat(psfrag.d.epspath)
+    entries = [format_entry(row) for row in psfrag.d.labels if row['label']]
+    return RenderCache.key([], os.path.abspath(psfrag.d.epspath), st.st_size, st.st_mtime, psfrag.preamble,
+                           psfrag.begin, psfrag.figure, psfrag.ending, psfrag.engine, *entries)
+
+
+class ThumbnailCache:
+    def __init__(self, maxitems=50):
+        """ Least recently used thumbnails (png contents) by key, at most maxitems of them."""
+        self.maxitems = maxitems
+        self.items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            png = self.items.pop(key, None)
+            if png is not None:
+                self.items[key] = png
+            return png
+
+    def put(self, key, png):
+        with self._lock:
+            self.items.pop(key, None)
+            self.items[key] = png
+            while len(self.items) > self.maxitems:
+                self.items.popitem(last=False)
+
+
+class Previewer:
+    def __init__(self, callback, density=PREVIEW_DENSITY, maxitems=50):
+        """ Renders previews one at a time in a thread of its own, and calls callback(key, png, error)
+            from it with the png contents, or None and the error when the render fails.
+            :param density: resolution of the previews (dpi).
+            :param maxitems: number of thumbnails kept in memory.
+        """
+        self.logger = logging.getLogger('preview.Previewer')
+        self.callback = callback
+        self.density = density
+        self.thumbnails = ThumbnailCache(maxitems)
+        # Latest request (key, psfrag) not started yet, and the job being rendered
+        self.pending = None
+        self.current = None
+        self.stopped = False
+        self._cond = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='preview')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def request(self, key, psfrag):
+        """ Renders the preview of psfrag (a copy of its own, see MainGui.snapshot). It replaces the
+            request waiting to start, and the render in progress is cancelled: it is outdated.
+        """
+        with self._cond:
+            self.pending = (key, psfrag)
+            if self.current is not None:
+                self.current.cancel()
+            self._cond.notify()
+
+    def render(self, psfrag):
+        """ Converts psfrag to a single png in a scratch directory, and returns its contents."""
+        d = psfrag.d
+        d.eps, d.pdf, d.svg, d.png = False, False, False, True
+        d.density = self.density
+        psfrag.scratch = True
+        psfrag.buildroot = None
+        psfrag.builddir = None
+        psfrag.cache = None
+        psfrag.profile = False
+        psfrag.listener = None
+        try:
+            psfrag.create_subs()
+            psfrag.do_replace()
+            return psfrag.collect(inmemory=True)['-latex.png']
+        finally:
+            psfrag.cleanup()
+
+    def run(self):
+        while True:
+            with self._cond:
+                while self.pending is None and not self.stopped:
+                    self._cond.wait(0.5)
+                if self.stopped:
+                    return
+                key, psfrag = self.pending
+                self.pending = None
+                self.current = psfrag
+            png, error, cancelled = None, None, False
+            try:
+                png = self.render(psfrag)
+                self.thumbnails.put(key, png)
+            except PipelineCancelled:
+                cancelled = True
+            except (PipelineError, IOError, OSError, ValueError) as e:
+                error = format_diagnostic(psfrag.diagnostics[0]) if psfrag.diagnostics else str(e)
+                self.logger.debug("Preview failed: %s" % error)
+            with self._cond:
+                self.current = None
+            if not cancelled:
+                self.callback(key, png, error)
+
+    def stop(self):
+        with self._cond:
+            self.stopped = True
+            if self.current is not None:
+                self.current.cancel()
+            self._cond.notify()
+        self.thread.join()
@@ -0,0 +1,245 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import multiprocessing
+import yaml
+import logging
+
+from core import Data, PSFrag, ENGINES, FORMATS
+from cache import RenderCache
+from library import SubsLibrary, default_library
+from batch import expand_inputs, prepare_format, render_job, run_pool
+
+logging.getLogger('project').addHandler(logging.NullHandler())
+
+""" Project manifests: a YAML file listing the figures of a document with their substitution files,
+    formats and densities, shared in 'defaults' or per figure. The whole project is built in one run
+    on a pool of worker processes, skipping the figures whose inputs did not change:
+
+    defaults:
+      subs: subs/common.tex
+      formats: [eps, pdf]
+      optimize: 0.1
+    figures:
+      - figures/chapter1/*.eps
+      - eps: figures/phase.eps
+        subs: subs/phase.tex
+        formats: [pdf, png]
+        density: [300, 150]
+"""
+
+# Input fingerprints and timings of the last build of every figure, next to the manifest
+BUILD_STATE = '.pypsfrag-build.json'
+# Settings of a figure, in 'defaults' or in the figure itself
+SETTINGS = {'subs': None, 'formats': ['eps'], 'density': 300, 'engine': 'classic', 'packages': [],
+            'outdir': None, 'require': None, 'optimize': None}
+
+
+def load_manifest(path):
+    """ Reads the manifest at path. Paths in it are relative to its directory.
+        :return: list of figures: dictionaries with the eps path and all the SETTINGS.
+    """
+    f = open(path)
+    try:
+        manifest = yaml.safe_load(f) or {}
+    finally:
+        f.close()
+    if not isinstance(manifest, dict) or not isinstance(manifest.get('figures'), list):
+        raise ValueError("%s: a list of figures is required" % path)
+    root = os.path.dirname(os.path.abspath(path))
+    defaults = dict(SETTINGS)
+    defaults.update(check_settings(manifest.get('defaults') or {}, 'defaults'))
+    figures = []
+    seen = set()
+    for number, entry in enumerate(manifest['figures'], 1):
+        if not isinstance(entry, dict):
+            entry = {'eps': entry}
+        if 'eps' not in entry:
+            raise ValueError("%s: figure %d has no eps file" % (path, number))
+        settings = dict(defaults)
+        settings.update(check_settings(dict((k, v) for k, v in entry.items() if k != 'eps'), 'figure %d' % number))
+        epsfiles = expand_inputs([os.path.join(root, str(entry['eps']))])
+        if not epsfiles:
+            raise ValueError("%s: no eps files for figure %d (%s)" % (path, number, entry['eps']))
+        for epspath in epsfiles:
+            epspath = os.path.normpath(epspath)
+            if epspath in seen:
+                continue
+            seen.add(epspath)
+            figure = dict(settings, eps=epspath)
+            for key in ('subs', 'outdir'):
+                if figure[key]:
+                    figure[key] = os.path.normpath(os.path.join(root, figure[key]))
+            figures.append(figure)
+    return figures
+
+
+def check_settings(settings, where):
+    """ Validates the settings of a figure (or the defaults) and returns them."""
+    if not isinstance(settings, dict):
+        raise ValueError("%s: settings must be a mapping" % where)
+    unknown = [key for key in settings if key not in SETTINGS]
+    if unknown:
+        raise ValueError("%s: unknown settings %s" % (where, ", ".join(sorted(unknown))))
+    settings = dict(settings)
+    if 'formats' in settings:
+        if not isinstance(settings['formats'], list):
+            settings['formats'] = [settings['formats']]
+        bad = [ext for ext in settings['formats'] if ext not in FORMATS]
+        if bad or not settings['formats']:
+            raise ValueError("%s: unknown formats %s" % (where, ", ".join(map(str, bad))))
+    if 'density' in settings:
+        densities = settings['density'] if isinstance(settings['density'], list) else [settings['density']]
+        if not densities or not all(isinstance(d, int) and d > 0 for d in densities):
+            raise ValueError("%s: densities must be positive integers" % where)
+    if settings.get('engine', 'classic') not in ENGINES:
+        raise ValueError("%s: unknown engine %s" % (where, settings['engine']))
+    if settings.get('require') not in (None, 'all', 'any'):
+        raise ValueError("%s: require must be all or any" % where)
+    optimize = settings.get('optimize')
+    if optimize is not None and (isinstance(optimize, bool) or not isinstance(optimize, (int, float)) or optimize < 0):
+        raise ValueError("%s: optimize must be a tolerance in points" % where)
+    if settings.get('packages') and not isinstance(settings['packages'], list):
+        settings['packages'] = [settings['packages']]
+    return settings
+
+
+def figure_options(figure, options):
+    """ Options of render_job for the figure: those of the command line, with the settings of the figure."""
+    options = dict(options)
+    formats = figure['formats']
+    options.update({'eps': 'eps' in formats, 'pdf': 'pdf' in formats, 'svg': 'svg' in formats,
+                    'png': 'png' in formats, 'dsty': figure['density'], 'engine': figure['engine'],
+                    'packages': figure['packages'], 'outdir': figure['outdir'], 'require': figure['require'],
+                    'optimize': figure['optimize'], 'combine': False})
+    return options
+
+
+def output_paths(figure):
+    """ Files the build of the figure creates."""
+    data = Data(None, None, './', 'pdf' in figure['formats'], 'svg' in figure['formats'],
+                'png' in figure['formats'], figure['density'])
+    data.eps = 'eps' in figure['formats']
+    name = os.path.basename(figure['eps'])[:-4]
+    destdir = figure['outdir'] or os.path.dirname(figure['eps'])
+    return [os.path.join(destdir, name + sfx) for sfx in PSFrag(data).output_suffixes()]
+
+
+def fingerprint(figure, library=None, project=None):
+    """ Hash of the inputs of the figure: content of the eps and substitution files, and its settings.
+        :param library: path of the substitution library the replacements are suggested from (--suggest),
+                        whose content is also an input, and project the preferred project.
+    """
+    files = [figure['eps']] + ([figure['subs']] if figure['subs'] else [])
+    if library is not None and os.path.exists(library):
+        files.append(library)
+    return RenderCache.key(files, json.dumps(figure, sort_keys=True), library, project)
+
+
+def load_state(statename):
+    try:
+        f = open(statename)
+        try:
+            return json.load(f)
+        finally:
+            f.close()
+    except (IOError, ValueError):
+        return {}
+
+
+def save_state(statename, state):
+    f = open(statename + '.tmp', 'w')
+    json.dump(state, f, indent=2, sort_keys=True)
+    f.close()
+    os.rename(statename + '.tmp', statename)
+
+
+def build(path, options, jobs=None):
+    """ Builds the figures of the manifest at path on a pool of jobs worker processes (all the cores by
+        default). Figures whose inputs did not change since the last build, and whose outputs exist,
+        are skipped. The others start longest first, after the timings of the previous builds (new
+        figures first), so that the long ones do not run at the end on a single core.
+        :param options: options of render_job shared by all the figures (cache, format, build directory, ...).
+        :return: list of results as returned by render_job, in the order of the manifest.
+    """
+    logger = logging.getLogger('project.build')
+    figures = load_manifest(path)
+    statename = os.path.join(os.path.dirname(os.path.abspath(path)), BUILD_STATE)
+    state = load_state(statename)
+    root = os.path.dirname(os.path.abspath(path))
+    results = {}
+    tasks = []
+    keys = {}
+    library = None
+    if options.get('suggest'):
+        library = os.path.abspath(options.get('library') or default_library())
+        # Create it now, and not in the first job, so the fingerprints of the next build are the same
+        SubsLibrary(library).close()
+    for figure in figures:
+        name = os.path.relpath(figure['eps'], root)
+        if figure['subs'] is None:
+            figure['subs'] = options.get('subs')
+        if figure['optimize'] is None:
+            figure['optimize'] = options.get('optimize')
+        # The packages of the command line (-P) come first, followed by those of the manifest
+        packages = list(options.get('packages') or [])
+        figure['packages'] = packages + [p for p in figure['packages'] or [] if p not in packages]
+        try:
+            keys[figure['eps']] = fingerprint(figure, library, options.get('project'))
+        except (IOError, OSError) as e:
+            results[figure['eps']] = (figure['eps'], False, str(e), 0.0, None)
+            continue
+        previous = state.get(name, {})
+        if previous.get('key') == keys[figure['eps']] and all(os.path.exists(p) for p in output_paths(figure)):
+            results[figure['eps']] = (figure['eps'], True, "up to date", 0.0, None)
+            continue
+        if figure['outdir'] and not os.path.isdir(figure['outdir']):
+            os.makedirs(figure['outdir'])
+        task = (figure['eps'], figure['subs'], root, figure_options(figure, options))
+        tasks.append((previous.get('wall', float('inf')), name, task))
+    # Longest processing time first
+    tasks.sort(key=lambda t: (-t[0], t[1]))
+    tasks = [task for _, _, task in tasks]
+    logger.info("%d figures, %d up to date." % (len(figures), len(figures) - len(tasks)))
+    if tasks:
+        if jobs is None or jobs < 1:
+            jobs = multiprocessing.cpu_count()
+        jobs = min(jobs, len(tasks))
+        if not options.get('noformat', True):
+            for packages in set(tuple(task[3]['packages'] or ()) for task in tasks):
+                prepare_format(list(packages), root)
+        logger.info("Building %d figures using %d worker processes ..." % (len(tasks), jobs))
+
+        def collect(result):
+            results[result[0]] = result
+            name = os.path.relpath(result[0], root)
+            entry = state.setdefault(name, {})
+            entry['wall'] = result[3]
+            if result[1]:
+                entry['key'] = keys[result[0]]
+            else:
+                entry.pop('key', None)
+            logger.debug("%s finished (%s)." % (name, 'ok' if result[1] else 'failed'))
+
+        try:
+            run_pool(render_job, tasks, jobs, collect)
+        finally:
+            save_state(statename, state)
+    return [results[figure['eps']] for figure in figures]
@@ -23,10 +23,8 @@ import sys
 import logging.config
 from colorlog import ColoredFormatter
 import os
-# import gi
-# gi.require_version('Gtk', '3.10')
-from gi.repository import Gtk
-from gui import MainGui, Data, PSFrag
+import time
+from core import Data, PSFrag, ENGINES, default_builddir
 
 __author__ = 'Jose M. Esnaola Acebes'
 
@@ -78,6 +76,18 @@ logger.debug('We are working in %s' % str(cwd))
 
 # PARSER ########################################################################
 
+
+def densities(text):
+    """ Density of the png output, or list of densities separated by commas."""
+    try:
+        values = [int(value) for value in text.split(',') if value.strip()]
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid density: %s" % text)
+    if not values or min(values) <= 0:
+        raise argparse.ArgumentTypeError("invalid density: %s" % text)
+    return values[0] if len(values) == 1 else values
+
+
 # We need the name of the eps file, and optionally a file to handle substitutions
 logger.debug('Formatting parser')
 parser = argparse.ArgumentParser(
@@ -100,43 +110,280 @@ parser.add_argument('-svg', '--svg', default=False, dest='svg', action='store_tr
                     help='Add output format: svg.')
 parser.add_argument('-png', '--png', default=False, dest='png', action='store_true',
                     help='Add output format: png.')
-parser.add_argument('--density', default=300, dest='dsty', type=int, help='Density of the png image.')
+parser.add_argument('--density', default=300, dest='dsty', type=densities, metavar='N[,N...]',
+                    help='Density of the png image. With a list (72,150,600) a png is created for every density '
+                         '(<name>-latex-<N>.png), rasterizing once at the highest one.')
+parser.add_argument('--no-cache', default=False, dest='nocache', action='store_true',
+                    help='Do not use the render cache: always run the LaTeX toolchain.')
+parser.add_argument('--cache-size', default=200, dest='cachesize', type=int, metavar='MB',
+                    help='Size cap of the render cache in MB. Default is 200.')
+parser.add_argument('-P', '--package', default=[], dest='packages', type=str, action='append', metavar='<package>',
+                    help='LaTeX package to load in the preamble (it may be repeated).')
+parser.add_argument('--no-format', default=False, dest='noformat', action='store_true',
+                    help='Do not use a precompiled LaTeX format for the preamble.')
+parser.add_argument('-e', '--engine', default='classic', dest='engine', choices=ENGINES,
+                    help='Conversion engine: classic (dvips, ps2pdf, pdfcrop, pdftops, ps2eps) or fast '
+                         '(eps straight from dvips -E, pdf only when needed). Default is classic.')
+parser.add_argument('--profile', default=None, dest='profile', type=str, nargs='?', const='pypsfrag-report.json',
+                    metavar='<report.json>',
+                    help='Write the measures of every stage (wall and cpu time, exit code, output size) in '
+                         '<name>-report.json, and in batch mode an aggregated report (pypsfrag-report.json).')
+parser.add_argument('--scratch', default=False, dest='scratch', action='store_true',
+                    help='Work in a private scratch directory (in memory when possible) and only move the '
+                         'outputs next to the .eps file, instead of writing the intermediate files there.')
+parser.add_argument('-o', '--output-dir', default=None, dest='outdir', type=str, metavar='<dir>',
+                    help='Directory where the outputs are moved (it implies --scratch).')
+parser.add_argument('--build-dir', default=None, dest='builddir', type=str, nargs='?', const=default_builddir(),
+                    metavar='<dir>',
+                    help='Keep the intermediate files in a build directory of every figure under <dir> (default is '
+                         '%s), and only run again the stages whose inputs changed. The GUI always uses it.'
+                         % default_builddir())
+# Without a value, --optimize takes the default tolerance of epsopt, which is only imported when it is used
+parser.add_argument('--optimize', default=None, dest='optimize', type=float, nargs='?', const=True,
+                    metavar='<tolerance>',
+                    help='Pre-optimize the .eps file before LaTeX: remove the points of the paths closer than '
+                         '<tolerance> points (default 0.1) to the simplified path, and the redundant graphics '
+                         'state operations. The texts painted with show are left untouched.')
+parser.add_argument('--check', default=False, dest='check', action='store_true',
+                    help='Only check the tags of the substitutions against the texts of the .eps files, reporting '
+                         'the missing tags and the texts without replacement. Nothing is compiled.')
+parser.add_argument('--require', default=None, dest='require', choices=['any', 'all'],
+                    help='Do not compile a file unless all (or any) of its tags are found in it.')
+parser.add_argument('--library', default=None, dest='library', type=str, metavar='<library.sqlite>',
+                    help='Substitution library (SQLite). Default is ~/.local/share/pypsfrag/library.sqlite.')
+parser.add_argument('--import-subs', default=None, dest='importsubs', type=str, nargs='+', metavar='<subs.tex>',
+                    help='Import substitution files into the library and exit.')
+parser.add_argument('--project', default=None, dest='project', type=str, metavar='<name>',
+                    help='Project of the imported entries (default is the directory of each file), and '
+                         'preferred project when suggesting replacements.')
+parser.add_argument('--suggest', default=False, dest='suggest', action='store_true',
+                    help='Suggest replacements from the library for the labels of the eps file without one.')
+parser.add_argument('-b', '--batch', default=None, dest='batch', type=str, nargs='+', metavar='<path>',
+                    help='Batch mode (no GUI): .eps files, glob patterns or directories to convert.')
+parser.add_argument('--single-run', default=False, dest='combine', action='store_true',
+                    help='Batch mode: compile the figures of each worker in a single LaTeX document.')
+parser.add_argument('-j', '--jobs', default=None, dest='jobs', type=int, metavar='N',
+                    help='Number of worker processes in batch mode. Default is the number of cores.')
+parser.add_argument('--serve', default=None, dest='serve', type=str, nargs='?', const='', metavar='<socket>',
+                    help='Run a render server with a pool of -j workers listening on a Unix socket '
+                         '(default is $XDG_RUNTIME_DIR/pypsfrag.sock).')
+parser.add_argument('--submit', default=None, dest='submit', type=str, nargs='?', const='', metavar='<socket>',
+                    help='Send the conversion of the -f file to a running render server.')
+parser.add_argument('--stop-server', default=None, dest='stopserver', type=str, nargs='?', const='',
+                    metavar='<socket>', help='Stop a running render server.')
+parser.add_argument('--build', default=None, dest='build', type=str, nargs='?', const='pypsfrag.yaml',
+                    metavar='<manifest.yaml>',
+                    help='Build every figure of a project manifest (default is pypsfrag.yaml) on -j workers, '
+                         'skipping the figures whose inputs did not change.')
+parser.add_argument('-w', '--watch', default=False, dest='watch', action='store_true',
+                    help='Render again whenever the .eps file, the subs file or the generated subs-<name>.tex '
+                         'change (in the GUI too).')
+parser.add_argument('--poll', default=False, dest='poll', action='store_true',
+                    help='Watch mode: poll the files instead of using inotify.')
 
 args = parser.parse_args()
 logger.debug('Introduced arguments: %s' % str(args))
 args = vars(args)
+if args['optimize'] is True:
+    from epsopt import TOLERANCE
+    args['optimize'] = TOLERANCE
 epspath = args['epsfile']
 subspath = args['subs']
 logger.debug('.eps file path: %s' % epspath)
 logger.debug('.tex file path: %s' % subspath)
 
+if args['outdir'] is not None and not os.path.isdir(args['outdir']):
+    os.makedirs(args['outdir'])
+
 # ################################################################################
 
+if args['importsubs']:
+    from library import SubsLibrary
+
+    library = SubsLibrary(args['library'])
+    for path in args['importsubs']:
+        library.import_subs(path, args['project'])
+    library.close()
+    exit(0)
+
+if args['serve'] is not None:
+    from server import RenderServer
+
+    args['subs'] = os.path.abspath(subspath)
+    args['cwd'] = cwd
+    RenderServer(args['serve'] or None, args['jobs'], args).serve_forever()
+    exit(0)
+
+if args['submit'] is not None or args['stopserver'] is not None:
+    import socket
+    from server import submit
+
+    if args['stopserver'] is not None:
+        request = {'command': 'shutdown'}
+        socketpath = args['stopserver'] or None
+    elif epspath is None:
+        logger.error("Select a .eps file using -f option.")
+        exit(-1)
+    else:
+        request = {'eps': os.path.abspath(epspath), 'subs': os.path.abspath(subspath), 'density': args['dsty'],
+                   'formats': ['eps'] + [ext for ext in ('pdf', 'svg', 'png') if args[ext]]}
+        if args['optimize'] is not None:
+            request['optimize'] = args['optimize']
+        socketpath = args['submit'] or None
+    try:
+        response = submit(request, socketpath)
+    except socket.error as e:
+        logger.error("Could not reach the render server: %s" % e)
+        exit(-1)
+    if not response['ok']:
+        logger.error("Replacement failed: %s" % response['error'])
+        exit(1)
+    for output in response.get('outputs', []):
+        logger.info("Written %s" % output)
+    if 'elapsed' in response:
+        logger.info("Done in %.2f s." % response['elapsed'])
+    exit(0)
+
+if args['build'] is not None:
+    from project import build
+    from batch import print_summary, write_report
+
+    t0 = time.time()
+    try:
+        results = build(args['build'], args, args['jobs'])
+    except (IOError, ValueError, yaml.YAMLError) as e:
+        logger.error("Cannot build %s: %s" % (args['build'], e))
+        exit(-1)
+    failed = print_summary(results)
+    if args['profile']:
+        write_report(results, args['profile'], time.time() - t0)
+    exit(1 if failed else 0)
+
+if args['batch']:
+    from batch import expand_inputs, run_batch, print_summary, write_report, check_files, print_check
+
+    logger.info("Batch mode selected.")
+    epsfiles = expand_inputs(args['batch'])
+    if not epsfiles:
+        logger.error("No .eps files to convert.")
+        exit(-1)
+    if args['check']:
+        exit(1 if print_check(check_files(epsfiles, subspath, cwd, args)) else 0)
+    t0 = time.time()
+    results = run_batch(epsfiles, subspath, cwd, args, args['jobs'])
+    failed = print_summary(results)
+    if args['profile']:
+        write_report(results, args['profile'], time.time() - t0)
+    exit(1 if failed else 0)
+
 # Now we create a data structure where the file names, extensions, etc. are treated:
 data = Data(epspath, subspath, cwd, args['pdf'], args['svg'], args['png'], args['dsty'])
-psfrag = PSFrag(data)
+cache = None
+if not args['nocache']:
+    from cache import RenderCache
+    cache = RenderCache(maxsize=args['cachesize'])
+texformat = None
+if not args['noformat']:
+    from texformat import FormatCache
+    texformat = FormatCache()
+psfrag = PSFrag(data, cache, texformat)
+psfrag.set_packages(args['packages'])
+psfrag.engine = args['engine']
+psfrag.profile = args['profile'] is not None
+psfrag.scratch = args['scratch'] or args['outdir'] is not None
+psfrag.require = args['require']
+psfrag.buildroot = args['builddir']
+psfrag.optimize = args['optimize']
 
 if args['nogui']:
+    from pipeline import PipelineError
+
     logger.info("Non-graphical UI selected.")
     if data.epspath is None:
         logger.error("Select a .eps file using -f option.")
         exit(-1)
-    if data.tags:
-        for tag, rep in zip(data.tags, data.reps):
-            if len(data.labels) == 1:
-                data.labels[0]['label'] = tag
-                data.labels[0]['latex'] = rep
-            else:
-                data.labels.append({'label': tag, 'latex': rep})
-    else:
+    found = data.load_subs_labels()
+    if args['suggest']:
+        from library import SubsLibrary
+        found = len(data.suggest_labels(SubsLibrary(args['library']), args['project'])) > 0 or found
+    if not found:
         logger.error("No substitutions to be made. Exiting.")
         exit(1)
+    try:
+        missing, unused = psfrag.validate()
+    except ValueError as e:
+        logger.error("%s. Exiting." % e)
+        exit(1)
+    if args['check']:
+        for text in unused:
+            logger.info("Text %s has no replacement." % text)
+        exit(1 if missing else 0)
+
+    # In watch mode, the reference content of the files is taken before the first render
+    watcher = None
+    if args['watch']:
+        from filewatch import FileWatcher, Coalescer
+        coalescer = Coalescer(lambda paths: rerender(paths))
+        watcher = FileWatcher(data.watched_paths(), coalescer.add, polling=args['poll'])
 
-    logger.info("Replacing ...")
-    psfrag.create_subs()
-    psfrag.do_replace()
-    logger.info("Done!")
+    def replace():
+        logger.info("Replacing ...")
+        try:
+            psfrag.create_subs()
+            if watcher is not None:
+                watcher.sync([psfrag.subsname])
+            psfrag.do_replace()
+            outputs = psfrag.collect(args['outdir'])
+        except PipelineError:
+            psfrag.cleanup()
+            logger.error("Replacement failed.")
+            return False
+        except (IOError, OSError) as e:
+            # Scratch directory, cache or outputs (the errors of the pipeline are already reported)
+            psfrag.cleanup()
+            logger.error("Replacement failed: %s" % e)
+            return False
+        for suffix in psfrag.output_suffixes():
+            logger.info("Written %s" % outputs[suffix])
+        logger.info("Done!")
+        return True
+
+    def rerender(paths):
+        logger.info("Changed: %s" % ", ".join(os.path.basename(path) for path in paths))
+        data.reload(paths)
+        try:
+            psfrag.validate()
+        except ValueError as e:
+            logger.error("%s. Waiting for changes ..." % e)
+            return
+        replace()
+
+    ok = replace()
+    if watcher is None:
+        exit(0 if ok else 1)
+    watcher.start()
+    logger.info("Watching %s (Ctrl+C to stop) ..." % ", ".join(data.watched_paths()))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        watcher.stop()
+        psfrag.cancel()
+        coalescer.stop()
 else:
-    mg = MainGui(data, psfrag)
+    # GTK is only loaded when the GUI starts, headless runs do not need it (nor a display)
+    # import gi
+    # gi.require_version('Gtk', '3.10')
+    from gi.repository import Gtk
+    from gui import MainGui
+
+    # Replace is usually clicked again after small changes, which only need the last stages
+    if psfrag.buildroot is None:
+        psfrag.buildroot = default_builddir()
+    library = None
+    if args['suggest']:
+        from library import SubsLibrary
+        library = SubsLibrary(args['library'])
+    mg = MainGui(data, psfrag, library, watch=args['watch'], polling=args['poll'], project=args['project'])
     mg.window.show_all()
     Gtk.main()
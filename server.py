@@ -0,0 +1,205 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import json
+import socket
+import threading
+import multiprocessing
+import logging
+
+from core import FORMATS, render
+from cache import RenderCache
+from batch import format_cache, prepare_format
+
+logging.getLogger('server').addHandler(logging.NullHandler())
+
+""" Render daemon: a pool of warm worker processes that accepts render jobs over a Unix socket.
+
+    Every connection sends one request, a JSON object in a single line, and gets one JSON line back:
+
+    {"eps": "/path/fig.eps", "subs": "/path/subs.tex", "entries": [{"label": "x", "latex": "$x$"}],
+     "formats": ["eps", "pdf", "svg", "png"], "density": 300}
+    -> {"ok": true, "outputs": ["/path/fig-latex.eps", ...], "error": null, "elapsed": 0.8, "report": {...}}
+
+    "subs" and "entries" are optional (the entries are added to the ones of the substitution file), as
+    are "formats", "density" and "optimize" (the options the server was started with), and "destdir" (the
+    directory of the outputs, next to the eps file by default). Every job works in its own scratch directory, so
+    jobs of the same figure do not interfere and only the outputs are written out of it. {"command": "ping"} and
+    {"command": "shutdown"} are also accepted.
+"""
+
+# Seconds a render job may take. A worker that dies (killed by the OOM killer, a crash of a tool) never
+# answers, and the pool of python 2 does not report it
+JOB_TIMEOUT = 600
+
+
+def default_socket():
+    rundir = os.environ.get('XDG_RUNTIME_DIR')
+    if rundir:
+        return os.path.join(rundir, 'pypsfrag.sock')
+    return '/tmp/pypsfrag-%d.sock' % os.getuid()
+
+
+def render_request(request, defaults):
+    """ Runs a render job in a worker process (see core.render).
+        :param request: dictionary as described in the module documentation.
+        :param defaults: server options (as in batch.render_job) for what the request does not give.
+    """
+    formats = request.get('formats')
+    if formats is None:
+        formats = ['eps'] + [ext for ext in FORMATS[1:] if defaults.get(ext)]
+    cache = None
+    if not defaults.get('nocache', True):
+        cache = RenderCache(maxsize=defaults['cachesize'])
+    texformat = None
+    if not defaults.get('noformat', True):
+        texformat = format_cache()
+    return render(request['eps'], request.get('entries', []), formats, request.get('subs', defaults['subs']),
+                  request.get('density', defaults['dsty']), request.get('engine', defaults.get('engine', 'classic')),
+                  defaults.get('packages'), cache, texformat, defaults.get('profile') is not None,
+                  scratch=True, destdir=request.get('destdir', defaults.get('outdir')),
+                  require=request.get('require', defaults.get('require')),
+                  optimize=request.get('optimize', defaults.get('optimize')))
+
+
+def render_task(args):
+    return render_request(*args)
+
+
+class RenderServer:
+    def __init__(self, socketpath=None, jobs=None, defaults=None, timeout=JOB_TIMEOUT):
+        self.logger = logging.getLogger('server.RenderServer')
+        self.socketpath = socketpath or default_socket()
+        self.jobs = jobs or multiprocessing.cpu_count()
+        self.defaults = defaults or {}
+        self.timeout = timeout
+        self.pool = None
+        self.sock = None
+        self.running = False
+
+    def start(self):
+        if os.path.exists(self.socketpath):
+            # A socket nobody listens to is left by a server that died
+            try:
+                submit({'command': 'ping'}, self.socketpath)
+                raise IOError("A server is already listening on %s." % self.socketpath)
+            except socket.error:
+                os.remove(self.socketpath)
+        if not self.defaults.get('noformat', True):
+            # Dump the format before the workers start, so they all find it
+            prepare_format(self.defaults.get('packages'), self.defaults['cwd'])
+        self.pool = multiprocessing.Pool(self.jobs)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.socketpath)
+        os.chmod(self.socketpath, 0o600)
+        self.sock.listen(16)
+        self.running = True
+        self.logger.info("Listening on %s with %d workers ..." % (self.socketpath, self.jobs))
+
+    def serve_forever(self):
+        self.start()
+        try:
+            while self.running:
+                try:
+                    conn = self.sock.accept()[0]
+                except socket.error:
+                    # The socket is closed on shutdown
+                    break
+                thread = threading.Thread(target=self.handle, args=(conn,))
+                thread.daemon = True
+                thread.start()
+        except KeyboardInterrupt:
+            self.logger.info("Interrupted.")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.running = False
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+            if os.path.exists(self.socketpath):
+                os.remove(self.socketpath)
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
+        self.logger.info("Server stopped.")
+
+    def handle(self, conn):
+        reader = conn.makefile('r')
+        try:
+            line = reader.readline()
+            try:
+                request = json.loads(line)
+            except ValueError:
+                response = {'ok': False, 'error': 'the request is not valid JSON'}
+            else:
+                try:
+                    response = self.dispatch(request)
+                except Exception as e:
+                    # Whatever render() does not report itself (an exception raised in the worker, a malformed request)
+                    self.logger.error("Request failed: %s" % e)
+                    response = {'ok': False, 'error': 'the request failed: %s' % e}
+            conn.sendall((json.dumps(response) + '\n').encode('utf-8'))
+        except socket.error as e:
+            self.logger.debug("Connection lost: %s" % e)
+        finally:
+            reader.close()
+            conn.close()
+        if not self.running and self.sock is not None:
+            # Wake accept() up in the main thread, which stops the server
+            try:
+                self.sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def dispatch(self, request):
+        command = request.get('command', 'render')
+        if command == 'ping':
+            return {'ok': True, 'workers': self.jobs}
+        if command == 'shutdown':
+            self.logger.info("Shutdown requested.")
+            self.running = False
+            return {'ok': True}
+        if command != 'render' or 'eps' not in request:
+            return {'ok': False, 'error': 'unknown request'}
+        self.logger.info("Rendering %s ..." % request['eps'])
+        try:
+            response = self.pool.apply_async(render_task, [(request, self.defaults)]).get(self.timeout)
+        except multiprocessing.TimeoutError:
+            self.logger.error("%s did not finish in %d s." % (request['eps'], self.timeout))
+            return {'ok': False, 'error': 'the job did not finish in %d s (its worker may have died)' % self.timeout}
+        self.logger.info("%s %s in %.2f s." % (request['eps'], 'done' if response['ok'] else 'failed',
+                                               response['elapsed']))
+        return response
+
+
+def submit(request, socketpath=None):
+    """ Sends a request to the server and returns its response."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socketpath or default_socket())
+        sock.sendall((json.dumps(request) + '\n').encode('utf-8'))
+        reader = sock.makefile('r')
+        line = reader.readline()
+        reader.close()
+    finally:
+        sock.close()
+    return json.loads(line)
@@ -0,0 +1,119 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import re
+
+""" Single-pass parser of substitution files:
+
+    % BEGIN INFO
+    % ...
+    % END INFO
+    % BEGIN PS
+    \\psfrag{tag}[posn][psposn][scale][rot]{replacement} %EndPs
+    % END PS
+
+    Every line is matched once against compiled patterns, so the cost is linear in the size of the file.
+"""
+
+OPTIONS = ('posn', 'psposn', 'scale', 'rot')
+
+# Everything up to the opening brace of the replacement, which ends at its matching brace (see closing_brace)
+PSFRAG_LINE = re.compile(r'\s*\\psfrag\{(?P<label>(?:[^{}\\]|\\.|\{[^{}]*\})*)\}'
+                         r'(?:\[(?P<posn>[^\]]*)\])?(?:\[(?P<psposn>[^\]]*)\])?'
+                         r'(?:\[(?P<scale>[^\]]*)\])?(?:\[(?P<rot>[^\]]*)\])?\{')
+BRACES = re.compile(r'\\.|[{}]')
+
+
+def closing_brace(text, start):
+    """ Position of the brace that closes the group opened just before start, or None."""
+    depth = 1
+    for match in BRACES.finditer(text, start):
+        token = match.group()
+        if token == '{':
+            depth += 1
+        elif token == '}':
+            depth -= 1
+            if depth == 0:
+                return match.start()
+    return None
+
+
+def new_label(label="", latex="", posn="", psposn="", scale="", rot=""):
+    """ A row of the labels table: tag, replacement and psfrag options."""
+    return {'label': label, 'latex': latex, 'posn': posn, 'psposn': psposn, 'scale': scale, 'rot': rot}
+
+
+def parse_subs(text):
+    """ Parses the content of a substitution file.
+        :return: tuple (info, entries, errors): the INFO block (or None), the list of entries (dictionaries
+                 with label, latex, the four psfrag options and the line number) and the list of
+                 (line number, message) of the malformed lines.
+    """
+    info = None
+    infolines = None
+    entries = []
+    errors = []
+    for number, line in enumerate(text.splitlines(), 1):
+        stripped = line.strip()
+        if infolines is not None:
+            infolines.append(line)
+            if stripped.startswith('% END INFO'):
+                info = "\n".join(infolines) + "\n"
+                infolines = None
+            continue
+        if stripped.startswith('% BEGIN INFO'):
+            infolines = [line]
+            continue
+        if not stripped or stripped.startswith('%'):
+            continue
+        match = PSFRAG_LINE.match(line)
+        if match is None:
+            if '\\psfrag' in line:
+                errors.append((number, "malformed \\psfrag entry: %s" % stripped))
+            else:
+                errors.append((number, "unexpected text: %s" % stripped))
+            continue
+        entry = match.groupdict('')
+        end = closing_brace(line, match.end())
+        if end is None:
+            errors.append((number, "unbalanced braces in the replacement of %s" % entry['label']))
+            continue
+        # Only a comment (%EndPs, or any other) may follow the replacement
+        rest = line[end + 1:].strip()
+        if rest and not rest.startswith('%'):
+            errors.append((number, "malformed \\psfrag entry: %s" % stripped))
+            continue
+        entry['latex'] = line[match.end():end]
+        entry['line'] = number
+        entries.append(entry)
+    if infolines is not None:
+        errors.append((number, "% BEGIN INFO without % END INFO"))
+    return info, entries, errors
+
+
+def format_entry(entry):
+    """ Writes an entry as a \\psfrag line. Empty options at the end are omitted, but [posn][psposn]
+        are always written.
+    """
+    options = [entry.get(option, '') or '' for option in OPTIONS]
+    while len(options) > 2 and not options[-1]:
+        options.pop()
+    if len(options) == 4 and not options[2]:
+        # Rotation without scale
+        options[2] = '1'
+    return "\\psfrag{%s}%s{%s} %%EndPs\n" % (entry['label'], "".join("[%s]" % o for o in options), entry['latex'])
@@ -0,0 +1,116 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import hashlib
+import subprocess
+import threading
+import logging
+
+from cache import default_cachedir
+
+logging.getLogger('texformat').addHandler(logging.NullHandler())
+
+""" Precompiled LaTeX formats: the preamble (document class and packages) is dumped once into a format
+    file with mylatexformat, and later compilations load it with -fmt instead of parsing the preamble.
+"""
+
+
+class FormatCache:
+    def __init__(self, cachedir=None):
+        self.logger = logging.getLogger('texformat.FormatCache')
+        if cachedir is None:
+            # Hidden, so that the eviction of the render cache never removes it
+            cachedir = os.path.join(default_cachedir(), '.formats')
+        self.cachedir = cachedir
+        if not os.path.isdir(self.cachedir):
+            try:
+                os.makedirs(self.cachedir)
+            except OSError:
+                if not os.path.isdir(self.cachedir):
+                    raise
+        self._installation = None
+        # Preambles whose format could not be dumped, they are not tried again
+        self.failed = set()
+        # The threads of a process (the preview and the compilation in the GUI) dump with the same jobname
+        self._lock = threading.Lock()
+
+    def installation(self):
+        """ Identifies the TeX installation: latex version and the date of its own format.
+            When the installation is updated, the formats dumped with the old one are rebuilt.
+        """
+        if self._installation is None:
+            try:
+                version = subprocess.Popen(['latex', '--version'], stdout=subprocess.PIPE,
+                                           universal_newlines=True).communicate()[0].split('\n')[0]
+                latexfmt = subprocess.Popen(['kpsewhich', '-engine=pdftex', 'latex.fmt'], stdout=subprocess.PIPE,
+                                            universal_newlines=True).communicate()[0].strip()
+                mtime = os.path.getmtime(latexfmt) if latexfmt else 0
+            except OSError as e:
+                self.logger.debug("Could not identify the TeX installation: %s" % e)
+                version, mtime = "", 0
+            self._installation = "%s %d" % (version, mtime)
+        return self._installation
+
+    def key(self, preamble):
+        return hashlib.sha1((self.installation() + '\n' + preamble).encode('utf-8')).hexdigest()[:16]
+
+    def get(self, preamble):
+        """ Returns the path of the format of preamble (to be given to latex -fmt), dumping it if
+            it does not exist yet. Returns None if the format cannot be created.
+        """
+        with self._lock:
+            key = self.key(preamble)
+            fmtname = os.path.join(self.cachedir, 'psfrag-%s' % key)
+            if os.path.exists(fmtname + '.fmt'):
+                return fmtname
+            if key in self.failed:
+                return None
+            if self.dump(preamble, key):
+                return fmtname
+            self.failed.add(key)
+            return None
+
+    def dump(self, preamble, key):
+        self.logger.info("Dumping LaTeX format for the preamble (only once) ...")
+        # Dump with a private name and rename it, so concurrent jobs never load a half written format
+        jobname = 'tmp-%s-%d' % (key, os.getpid())
+        texname = os.path.join(self.cachedir, jobname + '.tex')
+        f = open(texname, 'w')
+        f.write(preamble)
+        f.write("\\begin{document}\n\\end{document}\n")
+        f.close()
+        cmd = ['latex', '-ini', '-jobname=%s' % jobname, '-output-directory=%s' % self.cachedir,
+               '-interaction=nonstopmode', '&latex', 'mylatexformat.ltx', '"%s"' % texname]
+        try:
+            proc = subprocess.Popen(cmd, cwd=self.cachedir, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                    universal_newlines=True)
+            output = proc.communicate()[0]
+            ok = proc.returncode == 0 and os.path.exists(os.path.join(self.cachedir, jobname + '.fmt'))
+        except OSError as e:
+            output, ok = str(e), False
+        if ok:
+            os.rename(os.path.join(self.cachedir, jobname + '.fmt'),
+                      os.path.join(self.cachedir, 'psfrag-%s.fmt' % key))
+        else:
+            self.logger.warning("Could not dump the LaTeX format, the preamble will be parsed every time.")
+            self.logger.debug(output)
+        for ext in ('.tex', '.log', '.fmt'):
+            if os.path.exists(os.path.join(self.cachedir, jobname + ext)):
+                os.remove(os.path.join(self.cachedir, jobname + ext))
+        return ok
@@ -0,0 +1,130 @@
+"""
+    PyPSfrag - Graphical Tool to replace selected labels in an EPS file into LaTeX format.
+    Copyright (C) 2017  Jose M. Esnaola-Acebes
+
+    This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import re
+import logging
+
+logging.getLogger('texlog').addHandler(logging.NullHandler())
+
+""" Parser of the output of latex -file-line-error, fed line by line while latex runs. Every error becomes
+    a diagnostic: {'file', 'line', 'message', 'context', 'entry'}, where entry is the substitution entry
+    that caused it when it can be told (see LatexWatcher.locate).
+"""
+
+# file:line: message (latex -file-line-error)
+FILE_LINE_ERROR = re.compile(r'^([^\s:()][^:()]*):([0-9]+): (.*)$')
+# Errors without file and line
+TEX_ERROR = re.compile(r'^! (.*)$')
+# Context of the error: l.<line> <text read until the error>
+CONTEXT = re.compile(r'^l\.([0-9]+) ?(.*)$')
+CONTROL_SEQUENCE = re.compile(r'\\[A-Za-z@]+')
+# Lines read after an error while looking for its context
+CONTEXT_LINES = 8
+
+
+class LatexWatcher:
+    def __init__(self, sources=None):
+        """ :param sources: {path of a substitution file written for latex: {line number: entry}}."""
+        self.logger = logging.getLogger('texlog.LatexWatcher')
+        self.sources = dict((os.path.realpath(path), lines) for path, lines in (sources or {}).items())
+        self.diagnostics = []
+        self.pending = None
+        self.read = 0
+
+    def __call__(self, line):
+        """ Feeds a line of the output of latex.
+            :return: message of the first error, once its context has been read, to abort the job.
+        """
+        line = line.rstrip('\r\n')
+        if self.pending is not None:
+            match = CONTEXT.match(line)
+            self.read += 1
+            if match:
+                self.add_context(match.group(2))
+                if self.pending['line'] is None:
+                    self.pending['line'] = int(match.group(1))
+                return self.finish()
+            if line.startswith('<'):
+                # <recently read> \foo, <argument> ...
+                self.add_context(line)
+            if self.read >= CONTEXT_LINES:
+                return self.finish()
+            return None
+        match = FILE_LINE_ERROR.match(line)
+        if match:
+            self.start(match.group(1), int(match.group(2)), match.group(3))
+            return None
+        match = TEX_ERROR.match(line)
+        if match:
+            self.start(None, None, match.group(1))
+            if 'Emergency stop' in line or 'Fatal error' in line:
+                return self.finish()
+        return None
+
+    def start(self, filename, line, message):
+        self.pending = {'file': filename, 'line': line, 'message': message.strip(), 'context': None, 'entry': None}
+        self.read = 0
+
+    def add_context(self, text):
+        text = text.strip()
+        context = self.pending['context']
+        self.pending['context'] = text if context is None else "%s\n%s" % (context, text)
+
+    def finish(self):
+        """ Stores the pending diagnostic. :return: its message."""
+        diagnostic = self.pending
+        self.pending = None
+        diagnostic['entry'] = self.locate(diagnostic)
+        self.diagnostics.append(diagnostic)
+        return format_diagnostic(diagnostic)
+
+    def close(self):
+        """ Stores the diagnostic still waiting for its context, when latex has finished."""
+        if self.pending is not None:
+            self.finish()
+        return self.diagnostics
+
+    def locate(self, diagnostic):
+        """ Entry that caused the error: the one at that line of a substitution file, or else the only
+            replacement with one of the control sequences of the context, the latest first (psfrag
+            typesets the replacements at the \\includegraphics of the figure, far from the substitution
+            file).
+        """
+        if diagnostic['file'] is not None:
+            lines = self.sources.get(os.path.realpath(diagnostic['file']))
+            if lines is not None and diagnostic['line'] in lines:
+                return lines[diagnostic['line']]
+        text = "%s\n%s" % (diagnostic['message'], diagnostic['context'] or '')
+        entries = [entry for lines in self.sources.values() for entry in lines.values()]
+        for sequence in reversed(CONTROL_SEQUENCE.findall(text)):
+            found = [entry for entry in entries if sequence in entry['latex']]
+            if len(found) == 1:
+                return found[0]
+        return None
+
+
+def format_diagnostic(diagnostic):
+    text = diagnostic['message']
+    if diagnostic['file'] is not None:
+        text = "%s:%d: %s" % (os.path.basename(diagnostic['file']), diagnostic['line'], text)
+    entry = diagnostic['entry']
+    if entry is not None:
+        where = " (line %d of the substitution file)" % entry['line'] if entry.get('line') else ""
+        text += " [\\psfrag{%s}{%s}%s]" % (entry['label'], entry['latex'], where)
+    return text